@@ -1,16 +1,36 @@
 # .... LSABE access policy ...
 
 import sys
+import re
 import random
+import secrets
+from functools import lru_cache
 
 #
 #  Let A be an n × l matrix and p be the function that associates rows of A with the (security?) attributes.
 #  The access policy is denoted by (A,p). 
+#
+#  accessPolicy()                 - the stub described below (default)
+#  accessPolicy(policy, order)    - boolean policy like "(doctor and cardiology) or admin"
+#                                   compiled to monotone span program (Lewko-Waters)
 
 class accessPolicy:
-    def __init__(self):
-        self._n = 2                     # The number of columns
-        self._l = 5                     # The number of rows (security attributes)
+# order   - group order, required for compiled policies
+# w_cache - capacity of reconstruction coefficients cache (compiled policies)
+    def __init__(self, policy = None, order = None, w_cache = 1024):
+        self._policy = policy
+        if policy is None:
+            self._n = 2                     # The number of columns
+            self._l = 5                     # The number of rows (security attributes)
+            return
+
+        self._r = order
+        self._tree = _parse(policy)
+        self._rows = []                     # Sparse rows of A: column -> coefficient
+        self._rho = []                      # p: row -> attribute
+        self._n = self.__compile(self._tree, {0: 1}, 1)
+        self._l = len(self._rows)
+        self.coefficients = lru_cache(maxsize = w_cache)(self.__coefficients)
 
     @property
     def n(self):
@@ -20,31 +40,53 @@ class accessPolicy:
     def l(self):
         return self._l
 
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def compiled(self):
+        return self._policy is not None
+
 #  For testing simplicty I assume that A(i,0) = 1, A(i,j)=0 if j!=0 for any i
 #  So no matrix is stored, I just generate a value as required 
 #  Also I do not check that i is within valid range 0..l-1
     def A(self, i, j):
+        if self._policy is not None:
+            return self._rows[i].get(j, 0)
         if j==0:
             return 1
         return 0
 
 # p - the function that associates rows of A with the (security?) attributes
 # i - row of A, we return associated security attribute  
+# (attribute index for the stub, attribute name for compiled policy)
     def p(self,i):
+        if self._policy is not None:
+            return self._rho[i]
         return i 
 
 # A helper for lsabe.encrypt
 # Choose a random s∈Zp and a random vector v∈Znp with s as its first entry.
-    def randVector(self):
+# Compiled policies share the secret of the whole group order (it is the key exponent) 
+# zero - share 0 rather than a random secret (v[0] = 0); compiled policies draw from secrets
+    def randVector(self, zero = False):
         v=[]
         for i in range(self._n):
-            v.append(random.randrange(sys.maxsize))  
+            if self._policy is None:
+                v.append(random.randrange(sys.maxsize))
+            else:
+                v.append(secrets.randbelow(self._r))
+        if zero:
+            v[0] = 0
         return v
 
 # A helper for lsabe.encrypt
 # For each i∈[l], we let λ(i) denote A(i)·v, where A(i) is row i of A 
 # (and v - is a vector, generated by randVector)
     def lmbda(self, i, v):
+        if self._policy is not None:
+            return sum(a * v[j] for j, a in self._rows[i].items())
         lm = 0
         for j in range (len(v)):
             lm += self.A(i,j)*v[j]
@@ -57,3 +99,143 @@ class accessPolicy:
             return 1
         return 0
 
+# ................................................................................
+#  Policy compiler (Lewko-Waters): the root gets vector (1), OR passes the vector of
+#  the gate to both children, AND(x, y) passes v|1 to x and (0,...,0)|-1 to y, where
+#  the new column is the next free one. n-ary AND is compiled as nested binary ANDs.
+#  Leaves are the rows, in the order they appear in the policy.
+#  Returns the number of columns used so far.
+# ................................................................................
+    def __compile(self, node, v, c):
+        if node[0] == 'attr':
+            node[2].append(len(self._rows))
+            self._rows.append(v)
+            self._rho.append(node[1])
+            return c
+        if node[0] == 'or':
+            for child in node[1]:
+                c = self.__compile(child, v, c)
+            return c
+        (x, y) = (node[1][0], node[1][1] if len(node[1]) == 2 else ('and', node[1][1:]))
+        vx = dict(v)
+        vx[c] = 1
+        vy = {c: -1}
+        c = self.__compile(x, vx, c + 1)
+        return self.__compile(y, vy, c)
+
+# ................................................................................
+#  coefficients(attrs) → ((row, w(row)), ...) or None
+#  Minimal satisfying row subset for the attribute set (frozenset) and reconstruction
+#  coefficients with Σ[w(i)*A(i)] = (1,0,...,0) over this subset, None if the set does
+#  not satisfy the policy. LRU cache, see __init__
+# ................................................................................
+    def __coefficients(self, attrs):
+        S = _select(self._tree, attrs)
+        if S is None:
+            return None
+        S = sorted(S)
+        w = _solve([self._rows[i] for i in S], self._n, self._r)
+        if w is None:
+            return None
+        return tuple((S[k], w[k]) for k in range(len(S)) if w[k] != 0)
+
+# ................................................................................
+#  Policy parser
+#  policy := term {or term};  term := factor {and factor};  factor := (policy) | attribute
+#  Attributes are words of letters, digits and _-.:@ or "quoted strings"; 'and', 'or'
+#  are case insensitive. Nodes: ('attr', name, [row]), ('and', [nodes]), ('or', [nodes])
+# ................................................................................
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([\w\-\.:@]+))')
+
+def _parse(policy):
+    T = []
+    pos = 0
+    policy = policy.strip()
+    while pos < len(policy):
+        m = _TOKEN.match(policy, pos)
+        if m is None:
+            raise ValueError('Invalid access policy at ' + str(pos) + ': ' + policy)
+        if m.group(1):
+            T.append(('(', None))
+        elif m.group(2):
+            T.append((')', None))
+        elif m.group(3) is not None:
+            T.append(('attr', m.group(3)))
+        elif m.group(4).lower() in ('and', 'or'):
+            T.append((m.group(4).lower(), None))
+        else:
+            T.append(('attr', m.group(4)))
+        pos = m.end()
+
+    (node, k) = _parse_op(T, 0, 'or')
+    if k != len(T):
+        raise ValueError('Invalid access policy: ' + policy)
+    return node
+
+def _parse_op(T, k, op):
+    sub = 'and' if op == 'or' else None
+    C = []
+    while True:
+        if sub is None:
+            (node, k) = _parse_factor(T, k)
+        else:
+            (node, k) = _parse_op(T, k, sub)
+# Flatten (a or b) or c
+        C.extend(node[1] if node[0] == op else [node])
+        if k < len(T) and T[k][0] == op:
+            k += 1
+        else:
+            break
+    return (C[0] if len(C) == 1 else (op, C), k)
+
+def _parse_factor(T, k):
+    if k >= len(T):
+        raise ValueError('Invalid access policy: unexpected end')
+    if T[k][0] == 'attr':
+        return (('attr', T[k][1], []), k + 1)
+    if T[k][0] == '(':
+        (node, k) = _parse_op(T, k + 1, 'or')
+        if k >= len(T) or T[k][0] != ')':
+            raise ValueError('Invalid access policy: ) is expected')
+        return (node, k + 1)
+    raise ValueError('Invalid access policy: unexpected ' + T[k][0])
+
+# Minimal satisfying set of rows (the fewest rows), None if attrs do not satisfy the node
+def _select(node, attrs):
+    if node[0] == 'attr':
+        return set(node[2]) if node[1] in attrs else None
+    S = [_select(child, attrs) for child in node[1]]
+    if node[0] == 'or':
+        S = [s for s in S if s is not None]
+        return min(S, key = len) if S else None
+    if any(s is None for s in S):
+        return None
+    return set().union(*S)
+
+# Solves Σ[w(k)*M(k)] = (1,0,...,0) modulo r by Gauss-Jordan elimination
+# M - sparse rows, n - the number of columns. Free variables are set to zero
+def _solve(M, n, r):
+    m = len(M)
+# Augmented matrix of the transposed system: n equations, m unknowns
+    E = [[M[k].get(j, 0) % r for k in range(m)] + [1 if j == 0 else 0] for j in range(n)]
+    piv = []
+    row = 0
+    for col in range(m):
+        p = next((j for j in range(row, n) if E[j][col]), None)
+        if p is None:
+            continue
+        (E[row], E[p]) = (E[p], E[row])
+        inv = pow(E[row][col], -1, r)
+        E[row] = [(x * inv) % r for x in E[row]]
+        for j in range(n):
+            if j != row and E[j][col]:
+                f = E[j][col]
+                E[j] = [(x - f * y) % r for (x, y) in zip(E[j], E[row])]
+        piv.append(col)
+        row += 1
+    if any(E[j][m] for j in range(row, n)):
+        return None
+    w = [0] * m
+    for k in range(len(piv)):
+        w[piv[k]] = E[k][m]
+    return w
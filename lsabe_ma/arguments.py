@@ -2,6 +2,7 @@
 
 import argparse
 import pathlib
+from .lsabe_ma import CURVES
 
 
 def arguments_setup(max_kwd):
@@ -42,12 +43,42 @@ def arguments_setup(max_kwd):
                                         'If this flag is not set, MSK and PP are loaded from the files.'
     )
 
+    parser.add_argument('--max-keywords', 
+                        dest        =   'max_kw', 
+                        type        =   int,
+                        metavar     =   '<n>',
+                        default     =   max_kwd,
+                        help        =   'The maximum number of keywords per message (default: ' + str(max_kwd) + '). ' + 
+                                        'It is a system parameter that is stored to PP by --global-setup and is loaded from PP otherwise.'
+    )
+
+    parser.add_argument('--curve', 
+                        dest        =   'curve', 
+                        choices     =   CURVES,
+                        default     =   'SS512',
+                        help        =   'Pairing curve (default: SS512). ' + 
+                                        'It is a system parameter that is stored to PP by --global-setup and is loaded from PP otherwise.'
+    )
+
     parser.add_argument('--authority-setup', 
                         dest        =   'authority_setup_flag', 
                         action      =   'store_true',
                         help        =   'Generates attributes\' SK and PK files for the attributes managed by authority (CAUTION! NO CHECKS BEFORE OVERWRITE!)'
     )
 
+    parser.add_argument('--add-attributes', 
+                        dest        =   'add_attributes_flag', 
+                        action      =   'store_true',
+                        help        =   'Adds attributes to the authority. Keys of existing attributes and user keys are kept.'
+    )
+
+    parser.add_argument('--policy', 
+                        dest        =   'policy', 
+                        metavar     =   '<policy>',
+                        help        =   'Sets access policy of the authority, e.g.: --policy "(doctor and cardiology) or admin". ' + 
+                                        'Empty string restores the default policy. --search uses the attributes recorded in SK; --sec-attr, if provided, shall match them.'
+    )
+
     parser.add_argument('--keygen', 
                         dest        =   'keygen_flag', 
                         action      =   'store_true',
@@ -67,6 +98,47 @@ def arguments_setup(max_kwd):
                         help        =   'A text file with messages to be encrypted.'
     )
 
+    parser.add_argument('--bulk-keygen',  
+                        type        =   pathlib.Path, 
+                        dest        =   'bulk_keygen',
+                        metavar     =   '<file name>',
+                        help        =   'A text file with users to generate secret keys for. Each line shall contain comma-separated GID and attributes. ' + 
+                                        'The keys are stored to the single keystore authority-<id>.ks. --processes sets the number of worker processes.'
+    )
+
+    parser.add_argument('--precompute',  
+                        type        =   int, 
+                        dest        =   'precompute',
+                        metavar     =   '<number of coupons>',
+                        help        =   'Precompute encryption coupons (offline part of encryption) and add them to the coupon pool ' + 
+                                        'at the key path. --encrypt and --bulk-encrypt use coupons from the pool while it is not empty.'
+    )
+
+    parser.add_argument('--precompute-trapdoors',  
+                        type        =   int, 
+                        dest        =   'precompute_td',
+                        metavar     =   '<number of coupons>',
+                        help        =   'Precompute trapdoor coupons (offline part of trapdoor generation) for the user specified by --GID. ' + 
+                                        '--search uses coupons from the pool while it is not empty.'
+    )
+
+    parser.add_argument('--processes', 
+                        dest        =   'processes', 
+                        type        =   int,
+                        metavar     =   '<n>',
+                        default     =   None,
+                        help        =   'Number of worker processes for authority setup, bulk key generation, encryption under large access policies (64 rows or more) ' + 
+                                        'and decryption of large sets of search results. ' + 
+                                        'Everything is executed in the main process if it is not set.'
+    )
+
+    parser.add_argument('--text-format', 
+                        dest        =   'text_format', 
+                        action      =   'store_true',
+                        help        =   'Store and send keys, ciphertexts, trapdoors and transformation keys in the text format of earlier versions ' + 
+                                        '(for servers that do not support the binary format). Files of both formats are loaded regardless of this flag.'
+    )
+
     parser.add_argument('--clear-messages',  
                         dest        =   'clear_flag', 
                         action      =   'store_true',
@@ -129,8 +201,7 @@ def arguments_setup(max_kwd):
                         dest        =   'keywords',
                         metavar     =   '<keywords>',
                         default     =   [],
-                        help        =   'Keyword. Multiply keywords are supported, e.g.: --kwd searchable encryption algorithm. Maximun number of keywords is statically set to ' + str(max_kwd) +
-                                        ' If you want to change it, please modify MAX_KEYWORDS value in the source code.'
+                        help        =   'Keyword. Multiply keywords are supported, e.g.: --kwd searchable encryption algorithm. Maximun number of keywords is set by --global-setup --max-keywords <n>.'
     )
 
     parser.add_argument('--msg',  
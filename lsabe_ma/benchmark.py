@@ -0,0 +1,148 @@
+# ..... LSABE benchmark ......
+# Scaling of encryption, trapdoor generation and search with the number of keywords
+#
+# python -m lsabe_ma.benchmark [--kw-counts 10 100 1000 5000] [--repeat 3]
+#
+# Global and authority setup are executed in a temporary directory, so existing keys are
+# not touched.  For every keyword count the benchmark reports
+#   viete    - keyword polynomial by Formule de Viete (quadratic)
+#   tree     - keyword polynomial by product tree (polyFromRoots)
+#   encrypt  - EncryptAndIndexGen, keyword polynomial included, no precomputed coupons
+#   trapdoor - TrapdoorGen for one keyword, T4 of the full length (n+1)
+#   search   - SearchPrepared of the message against the trapdoor
+#
+# python -m lsabe_ma.benchmark --curves SS512 BN254 [--kw-counts 10] [--repeat 3]
+#
+# compares pairing curves instead, with the first keyword count. For every curve it reports
+#   ct bytes  - size of serialized ciphertext
+#   encrypt, trapdoor, search  - as above
+#   transform - TransformPrepared of the message
+#   decrypt   - Decrypt of the transformed ciphertext
+# Times are in milliseconds, the best of --repeat runs.
+
+import io
+import time
+import argparse
+import pathlib
+import tempfile
+
+from charm.toolbox.pairinggroup import ZR
+
+from .lsabe_ma import LSABE_MA, CURVES
+from .lsabe_authority import LSABE_AUTH
+from .formuleDeViete import formuleDeViete, polyFromRoots
+
+def best(f, repeat):
+    t = None
+    for i in range(repeat):
+        start = time.time()
+        f()
+        d = (time.time() - start) * 1000
+        t = d if t is None or d < t else t
+    return t
+
+GID = 'benchmark-user'
+
+# Global and authority setup at key_path, returns (authority, SK, z, TK)
+def setup(key_path, max_kw, curve = 'SS512'):
+    attrs = ['attribute-1']
+    LSABE_MA(key_path, max_kw, curve = curve).GlobalSetup()
+    auth = LSABE_AUTH(key_path, max_kw, 1)
+    auth.AuthoritySetup(attrs)
+    SK = auth.SecretKeyGen(GID, attrs)
+    z = auth.z()
+    TK = auth.TransKeyGen(SK, z, GID)
+    return (auth, SK, z, TK)
+
+def run(kw_counts, repeat, viete_max):
+    max_kw = max(kw_counts)
+
+    with tempfile.TemporaryDirectory() as key_dir:
+        (auth, SK, z, TK) = setup(pathlib.Path(key_dir), max_kw)
+        r = auth.group.order()
+
+        print('%8s %10s %10s %10s %10s %10s' % ('keywords', 'viete', 'tree', 'encrypt', 'trapdoor', 'search'))
+        for n in kw_counts:
+            KW = ['keyword-' + str(n) + '-' + str(i) for i in range(n)]
+            H = [auth.group.hash(kw, ZR) for kw in KW]
+
+            viete = best(lambda: formuleDeViete(H), repeat) if n <= viete_max else None
+            tree = best(lambda: polyFromRoots(H, r), repeat)
+# Keyword caches would hide the cost of hashing and polynomial construction
+            def encrypt():
+                auth.KeywordCacheClear()
+                return auth.EncryptAndIndexGen('benchmark message', KW)
+            CT = encrypt()
+            enc = best(encrypt, repeat)
+
+            TD = auth.TrapdoorGen(SK, GID, KW[:1], degree = n + 1)
+            td = best(lambda: auth.TrapdoorGen(SK, GID, KW[:1], degree = n + 1), repeat)
+            Q = auth.PrepareQuery(TD, TK)
+            A = auth.AggregateGen(CT)
+            srch = best(lambda: auth.SearchPrepared(CT, Q, A), repeat)
+
+            print('%8d %10s %10.2f %10.2f %10.2f %10.2f' % (n, '-' if viete is None else '%.2f' % viete, tree, enc, td, srch))
+
+def run_curves(curves, n, repeat):
+    KW = ['keyword-' + str(i) for i in range(n)]
+
+    print('%8s %10s %10s %10s %10s %10s %10s' % ('curve', 'ct bytes', 'encrypt', 'trapdoor', 'search', 'transform', 'decrypt'))
+    for curve in curves:
+        with tempfile.TemporaryDirectory() as key_dir:
+            (auth, SK, z, TK) = setup(pathlib.Path(key_dir), n, curve)
+
+            CT = auth.EncryptAndIndexGen('benchmark message', KW)
+            f = io.BytesIO()
+            auth.serialize__CT(CT, f, False)
+            enc = best(lambda: auth.EncryptAndIndexGen('benchmark message', KW), repeat)
+
+            TD = auth.TrapdoorGen(SK, GID, KW[:1])
+            td = best(lambda: auth.TrapdoorGen(SK, GID, KW[:1]), repeat)
+            Q = auth.PrepareQuery(TD, TK)
+            A = auth.AggregateGen(CT)
+            srch = best(lambda: auth.SearchPrepared(CT, Q, A), repeat)
+            trans = best(lambda: auth.TransformPrepared(CT, Q, A), repeat)
+            CTout = auth.TransformPrepared(CT, Q, A)
+            dec = best(lambda: auth.Decrypt(z, CTout), repeat)
+
+            print('%8s %10d %10.2f %10.2f %10.2f %10.2f %10.2f' % (curve, len(f.getvalue()), enc, td, srch, trans, dec))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'LSABE-MA keyword scaling benchmark')
+    parser.add_argument('--kw-counts',
+                        nargs       =   '+',
+                        type        =   int,
+                        dest        =   'kw_counts',
+                        metavar     =   '<n>',
+                        default     =   [10, 100, 500, 1000, 2000, 5000],
+                        help        =   'Numbers of keywords per message to benchmark'
+    )
+    parser.add_argument('--repeat',
+                        type        =   int,
+                        dest        =   'repeat',
+                        metavar     =   '<n>',
+                        default     =   3,
+                        help        =   'Number of runs per measurement, the best one is reported'
+    )
+    parser.add_argument('--viete-max',
+                        type        =   int,
+                        dest        =   'viete_max',
+                        metavar     =   '<n>',
+                        default     =   1000,
+                        help        =   'Formule de Viete is not measured for larger keyword sets (it is quadratic)'
+    )
+    parser.add_argument('--curves',
+                        nargs       =   '+',
+                        dest        =   'curves',
+                        choices     =   CURVES,
+                        metavar     =   '<curve>',
+                        help        =   'Compare ciphertext size and latency for the pairing curves: ' + ' '.join(CURVES)
+    )
+    args = parser.parse_args()
+    if args.curves:
+        run_curves(args.curves, args.kw_counts[0], args.repeat)
+    else:
+        run(args.kw_counts, args.repeat, args.viete_max)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# .... LSABE lazy ciphertext view ...
+# ctView - serialized ciphertext (see LSABE_AUTH.serialize__CT) that behaves as CT tuple
+#          (I, I0, I1, I2, I3, I4, I5, E1, E2, CM, AP).
+#
+# Most of stored ciphertexts do not match a query, and search does not need all fields
+# of the others (see LSABE_AUTH.SearchPrepared).  The view only records the positions of
+# the fields when it is created; a field is decoded on first access and kept.  The view
+# holds the deserializer and so the buffer of the ciphertext.
+
+# Field kinds: tuple of group elements, group element, single I2 value of earlier 
+# versions (decoded as a tuple), CM (two base64 payloads), AP (string, None if absent)
+_TUP, _VAL, _ONE, _CM, _STR = 0, 1, 2, 3, 4
+_KINDS = (_TUP, _VAL, _VAL, _TUP, _VAL, _TUP, _TUP, _VAL, _TUP, _CM, _STR)
+_UNDECODED = object()
+
+# I2 is a tuple except for ciphertexts of earlier versions: text format, where I2 is 
+# a group element rather than tuple size, and binary format version 1
+def I2_tuple(l):
+    if l.binary:
+        return l.version >= 2
+    return l.peek().isdigit()
+
+class ctView:
+# l - deserializer (DES) at the beginning of the ciphertext
+    def __init__(self, l):
+        self._l = l
+        self._kinds = list(_KINDS)
+        self._v = [_UNDECODED] * 11
+        self._pos = [None] * 11
+
+        for i in range(10):
+            self._pos[i] = l.tell()
+            if i == 3 and not I2_tuple(l):
+                self._kinds[i] = _ONE
+            if self._kinds[i] == _TUP:
+                l.skip_tup()
+            elif self._kinds[i] == _CM:
+                l.skip_str(2)
+            else:
+                l.skip_val(1)
+        self._pos[10] = l.tell()
+
+    def __len__(self):
+        return 11
+
+    def __getitem__(self, i):
+        if i < 0:
+            i = i + 11
+        if self._v[i] is _UNDECODED:
+            self._v[i] = self.__decode(i)
+        return self._v[i]
+
+    def __iter__(self):
+        for i in range(11):
+            yield self[i]
+
+# True for the fields decoded so far
+    def decoded(self, i):
+        return self._v[i] is not _UNDECODED
+
+    def __decode(self, i):
+        if i < 0 or i >= 11:
+            raise IndexError('ciphertext index out of range')
+        l = self._l.seek(self._pos[i])
+        if self._kinds[i] == _TUP:
+            return l.g_tup()
+        if self._kinds[i] == _VAL:
+            return l.g_val(1)[0]
+        if self._kinds[i] == _ONE:
+            return l.g_val(1)
+        if self._kinds[i] == _CM:
+            return (l.g_b64(), l.g_b64())
+        return None if l.eof() else l.g_str()
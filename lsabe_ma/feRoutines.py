@@ -1,21 +1,26 @@
 # ..... Frontend support routines ......
 
+import io
+import time
+import json
+import pathlib
 import requests
 
 from .lsabe_authority import LSABE_AUTH
+from .serializer import MIME_BINARY, g_frames
 
 def farewell():
         print('Exiting ... To get help please run python -m lsabe-ma --help.')
         exit(-1)
 
-def tryAuthorityLoadOrExit(key_path, MAX_KEYWORDS, authority_id):
+def tryAuthorityLoadOrExit(key_path, MAX_KEYWORDS, authority_id, binary = True):
     if authority_id is None:
         print('Authority id is not specified. All LSABE-MA actions other then initialization are executed against specific aothority')
         farewell()
 
     print('Loading authority-' + str(authority_id) +' attributes and keys from ' + str(key_path))
     try:
-        lsabe_auth = LSABE_AUTH(key_path, MAX_KEYWORDS, authority_id)
+        lsabe_auth = LSABE_AUTH(key_path, MAX_KEYWORDS, authority_id, binary = binary)
     except:
         print('Failed to initialize authority using master security key (MSK) and public properies (PP) at ' + str(key_path))
         farewell()
@@ -28,6 +33,114 @@ def tryAuthorityLoadOrExit(key_path, MAX_KEYWORDS, authority_id):
     print('authority-' + str(authority_id) + ' attributes and keys successfully loaded.')
     return lsabe_auth
 
+# The maximum number of keywords is a system parameter stored in PP
+def checkKeywordsOrExit(lsabe_auth, keywords):
+    if len(keywords) > lsabe_auth.max_kw:
+        print(str(len(keywords)) + ' keywords are provided. The maximum supported number of keywords is ' + str(lsabe_auth.max_kw) + '.' +
+              ' If you want to change it, please run --global-setup --max-keywords <n>') 
+        farewell()
+
+def tryCouponsLoad(lsabe_auth):
+    try:
+        n = lsabe_auth.CouponsLoad()
+        if n > 0:
+            print(str(n) + ' encryption coupons loaded from ' + lsabe_auth.ecp_fname)
+    except:
+        print('Failed to load encryption coupons from ' + lsabe_auth.ecp_fname + '. Coupons will be generated online.')
+
+def tryCouponsSave(lsabe_auth):
+    if lsabe_auth.coupons == 0:
+        return
+    try:
+        lsabe_auth.CouponsSave()
+        print(str(lsabe_auth.coupons) + ' encryption coupons saved to ' + lsabe_auth.ecp_fname)
+    except:
+        print('Failed to save encryption coupons to ' + lsabe_auth.ecp_fname)
+
+def tcFname(key_path, GID, authority_id):
+    return key_path.joinpath(GID + '-authority-' + str(authority_id) + '.tcp')
+
+# SK is loaded from GID-authority-N.sk or, if there is no such file, from the keystore of
+# bulk key generation
+def trySKLoadOrExit(lsabe_auth, key_path, GID, authority_id):
+    sk_fname = key_path.joinpath(GID + '-authority-' + str(authority_id) + '.sk')   
+    if not sk_fname.exists() and pathlib.Path(lsabe_auth.ks_fname).exists():
+        try:
+            SK = lsabe_auth.deserialize__KS(pathlib.Path(lsabe_auth.ks_fname), GID)
+        except:
+            SK = None
+        if SK is None:
+            print('Failed to load SK for ' + GID + ' from ' + lsabe_auth.ks_fname)
+            farewell()
+        print('SK loaded from ' + lsabe_auth.ks_fname)
+        return SK
+
+    try:
+        SK = lsabe_auth.deserialize__SK(sk_fname)
+    except:
+        print('Failed to load SK from ' + str(sk_fname))
+        farewell()
+    print('SK loaded from ' + str(sk_fname))
+    return SK
+
+def tryTrapdoorCouponsLoad(lsabe_auth, GID, tc_fname):
+    try:
+        n = lsabe_auth.TrapdoorCouponsLoad(GID, tc_fname)
+        if n > 0:
+            print(str(n) + ' trapdoor coupons loaded from ' + str(tc_fname))
+    except:
+        print('Failed to load trapdoor coupons from ' + str(tc_fname) + '. Coupons will be generated online.')
+
+def tryTrapdoorCouponsSave(lsabe_auth, GID, tc_fname):
+    if lsabe_auth.TrapdoorCoupons(GID) == 0:
+        return
+    try:
+        lsabe_auth.TrapdoorCouponsSave(GID, tc_fname)
+        print(str(lsabe_auth.TrapdoorCoupons(GID)) + ' trapdoor coupons saved to ' + str(tc_fname))
+    except:
+        print('Failed to save trapdoor coupons to ' + str(tc_fname))
+
+# The number of trapdoor T4 coefficients the server needs (None if unknown)
+def tryCorpusDegree(url):
+    try:
+        response = requests.get(url + "/corpus-stats")
+        if response.status_code == 200:
+            degree = response.json()['degree']
+            print('Server corpus: ' + str(response.json()['messages']) + ' messages, trapdoor degree ' + str(degree))
+            return max(degree, 1)
+    except:
+        pass
+    print('Failed to get corpus statistics from ' + url + '. Full size trapdoor will be generated.')
+    return None
+
+# Search request with serialized TD and TK, the response is streamed
+def trySearchRequestOrExit(lsabe_auth, url, TD, TK, attrs):
+    try:    
+        tds = io.BytesIO()
+        lsabe_auth.serialize__TD(TD, tds, False)
+
+        tks = io.BytesIO()
+        lsabe_auth.serialize__TK(TK, tks, False)
+        response = requests.get(url + "/search", 
+                    files={'TD': tds.getvalue(), 'TK': tks.getvalue()}, data={'ATTR': attrs},
+                    headers={'Accept': (MIME_BINARY + ', ' if lsabe_auth.binary else '') + 'application/x-ndjson, application/json'}, stream=True)
+
+        tds.close()
+        tks.close()
+    except:
+        print('Failed to send search request to ' + str(url) + ' Please ensure that the server is running.')
+        farewell()
+    return response
+
+# The corpus degree from 409 response to search request (None if it is not there)
+def staleDegree(response):
+    if response.status_code != 409:
+        return None
+    try:
+        return max(response.json()['degree'], 1)
+    except:
+        return None
+
 def chekGIDorExit(GID):
     if GID is None or not GID:
         print('No user identifier is provided. This action can be executed against specific user only. '
@@ -42,10 +155,12 @@ def globalSetup(lsabe_ma, args):
         print('Failed to store MSK and PP to ' + lsabe_ma.msk_fname +' and ' + lsabe_ma.pp_fname)
         farewell()
     print('MSK and PP saved to ' + lsabe_ma.msk_fname +' and ' + lsabe_ma.pp_fname)
+    print('The maximum number of keywords is ' + str(lsabe_ma.max_kw))
+    print('The pairing curve is ' + lsabe_ma.curve)
 
     if args.url is not None:
         try:
-            response = requests.post(args.url + "/global-setup", files={'PP': lsabe_ma.pp_fname(), 'MSK': lsabe_ma.msk_fname()})
+            response = requests.post(args.url + "/global-setup", files={'PP': open(lsabe_ma.pp_fname, 'rb'), 'MSK': open(lsabe_ma.msk_fname, 'rb')})
             if (response.status_code==200):
                 print('MSK and PP succesfully updated at ' + args.url)
             else:
@@ -65,30 +180,115 @@ def authoritySetup(args, MAX_KEYWORDS):
         farewell()
         
     try:
-        lsabe_auth = LSABE_AUTH(args.key_path, MAX_KEYWORDS, args.authority_id)
+        lsabe_auth = LSABE_AUTH(args.key_path, MAX_KEYWORDS, args.authority_id, binary = not args.text_format)
         print('Used master security key (MSK) and public properies (PP) at ' + str(args.key_path))
     except:
         print('Failed to initialize authority using master security key (MSK) and public properies (PP) at ' + str(args.key_path))
         farewell()
 
     try:
-        lsabe_auth.AuthoritySetup(args.attributes)
+        lsabe_auth.AuthoritySetup(args.attributes, args.processes)
     except:
         print('Failed to store authority-' + str(args.authority_id) + ' attributes and keys to ' + str(args.key_path))
         farewell()
     print('authority-' + str(args.authority_id) + ' attributes and keys saved to ' + str(args.key_path))
  
     if args.url is not None:
-        try:
-            response = requests.post(args.url + "/authority-setup", 
-                            files={ 'ASK': lsabe_auth.ask_fname(), 
-                                    'ATT': lsabe_auth.att_fname(),  
-                                    'APK': lsabe_auth.apk_fname()  })
-            if (response.status_code==200):
-                print('authority-' + str(args.authority_id) + ' atributes succesfully updated at ' + args.url)
-            else:
-                print('Failed to update authority-' + str(args.authority_id) + ' atributes at ' + args.url)
-        except:
-            print('Failed to send authority-' + str(args.authority_id) + ' atributes to ' + args.url)
+        tryAuthoritySend(lsabe_auth, args.url, args.authority_id)
+
+    return lsabe_auth
+
+def addAttributes(args):
+    print('Executing AuthoritySetup (PP)→(APK(i,j),ASK(i,j)) for new attributes ...')
+
+    if len(args.attributes) == 0:
+        print('--add-attributes flag is set but no security attributes are provided. --sec-attr attribute will be good enouph.')
+        farewell()
+
+    lsabe_auth = tryAuthorityLoadOrExit(args.key_path, args.max_kw, args.authority_id, not args.text_format)
+    try:
+        n = lsabe_auth.AuthorityAddAttributes(args.attributes, args.processes)
+    except:
+        print('Failed to store authority-' + str(args.authority_id) + ' attributes and keys to ' + str(args.key_path))
+        farewell()
+    print(str(n) + ' attributes added to authority-' + str(args.authority_id) + ', ' + 
+          str(len(args.attributes) - n) + ' skipped (managed by the authority already or repeated).')
 
-    return lsabe_auth
\ No newline at end of file
+    return lsabe_auth
+
+# Empty policy restores the default one
+def setPolicy(args):
+    lsabe_auth = tryAuthorityLoadOrExit(args.key_path, args.max_kw, args.authority_id, not args.text_format)
+    try:
+        lsabe_auth.AuthorityPolicy(args.policy if args.policy.strip() else None)
+    except ValueError as e:
+        print('Failed to compile access policy. ' + str(e))
+        farewell()
+    except:
+        print('Failed to store access policy to ' + lsabe_auth.pol_fname)
+        farewell()
+    if lsabe_auth.policy is None:
+        print('authority-' + str(args.authority_id) + ' uses default access policy.')
+    else:
+        print('authority-' + str(args.authority_id) + ' access policy "' + lsabe_auth.policy + '" saved to ' + lsabe_auth.pol_fname)
+
+    if args.url is not None:
+        tryAuthoritySend(lsabe_auth, args.url, args.authority_id)
+    return lsabe_auth
+
+# Sends authority keys, attributes and access policy (POL, if it is not the default one) 
+# to the server
+def tryAuthoritySend(lsabe_auth, url, authority_id):
+    try:
+        files = { 'ASK': open(lsabe_auth.ask_fname, 'rb'), 
+                  'ATT': open(lsabe_auth.att_fname, 'rb'),  
+                  'APK': open(lsabe_auth.apk_fname, 'rb')  }
+        if lsabe_auth.policy is not None:
+            files['POL'] = open(lsabe_auth.pol_fname, 'rb')
+        response = requests.post(url + "/authority-setup", files = files)
+        if (response.status_code==200):
+            print('authority-' + str(authority_id) + ' atributes and access policy succesfully updated at ' + url)
+        else:
+            print('Failed to update authority-' + str(authority_id) + ' atributes and access policy at ' + url)
+    except:
+        print('Failed to send authority-' + str(authority_id) + ' atributes and access policy to ' + url)
+
+# Decryption result
+def printMessage(msg):
+    if msg is None:
+        print('Failed to decrypt a message.')
+    else:
+        print('Message: \"' + msg + '\"' )
+
+# Streamed search response: yields serialized CTouts as they arrive, collects the final 
+# record (timings, sizes, number of messages) to rsp. Time spent waiting for the 
+# server is accumulated at rsp['receive_time']
+# ndjsonCTouts - text format, binaryCTouts - binary format (frames, see serializer.py)
+def binaryCTouts(response, rsp):
+    frames = g_frames(response.iter_content(chunk_size = None))
+    while True:
+        tm = time.time()
+        frame = next(frames, None)
+        rsp['receive_time'] = rsp.get('receive_time', 0) + time.time() - tm
+        if frame is None:
+            return
+        (kind, payload) = frame
+        if kind == b'C':
+            yield payload
+        else:
+            rsp.update(json.loads(payload))
+
+def ndjsonCTouts(response, rsp):
+    lines = response.iter_lines()
+    while True:
+        tm = time.time()
+        line = next(lines, None)
+        rsp['receive_time'] = rsp.get('receive_time', 0) + time.time() - tm
+        if line is None:
+            return
+        if line:
+            rec = json.loads(line)
+            if 'CTout' in rec:
+                yield rec['CTout']
+            else:
+                rsp.update(rec)
@@ -0,0 +1,77 @@
+# .... LSABE fixed-base exponentiation ...
+# fixedBase - windowed fixed-base table for an element that is raised to a power over and over
+#             (PP generators g and f)
+#
+# For the base b, the window w and the group order r the table holds b^(d * 2^(w*i))
+# for every non-zero digit d < 2^w and every window position i < ceil(log2(r)/w).
+# b^e is then a product of one table entry per non-zero w-bit digit of e, so there are
+# no squarings at all and ~ log2(r)/w multiplications instead of a full exponentiation.
+
+class fixedBase:
+    def __init__(self, group, base, window = 4, table = None):
+        self.__g = group
+        self.__r = group.order()
+        self._base = base
+        self._w = window
+        if table is None:
+            table = self.__build()
+        self._t = table
+
+    @property
+    def base(self):
+        return self._base
+
+    @property
+    def window(self):
+        return self._w
+
+# Table rows: row i is (b^(1*2^(w*i)), b^(2*2^(w*i)), ... , b^((2^w-1)*2^(w*i)))
+    def __build(self):
+        rows = (self.__r.bit_length() + self._w - 1) // self._w
+        nd = (1 << self._w) - 1
+        t = []
+        bi = self._base
+        for i in range(rows):
+            row = [bi]
+            for d in range(1, nd):
+                row.append(row[d - 1] * bi)
+            t.append(tuple(row))
+            bi = row[nd - 1] * bi                  # b^(2^(w*(i+1)))
+        return tuple(t)
+
+# e is either ZR element or (possibly negative) integer
+    def pow(self, e):
+        if not isinstance(e, int):
+            e = int(e)
+        e = e % self.__r
+
+        mask = (1 << self._w) - 1
+        R = None
+        i = 0
+        while e:
+            d = e & mask
+            if d:
+                R = self._t[i][d - 1] if R is None else R * self._t[i][d - 1]
+            e >>= self._w
+            i += 1
+
+        if R is None:
+            return self._base ** 0
+        return R
+
+# ................................................................................
+#  Table serializer and deserializer
+#  l is SER or DES object, so several tables can share one file
+# ................................................................................
+    def serialize(self, l):
+        l.p_size(self._w).p_val((self._base, )).p_size(len(self._t))
+        for row in self._t:
+            l.p_tup(row)
+
+    @staticmethod
+    def deserialize(group, l):
+        w = l.g_size()
+        (base, ) = l.g_val(1)
+        sz = l.g_size()
+        t = tuple(l.g_tup() for i in range(sz))
+        return fixedBase(group, base, w, t)
@@ -34,3 +34,57 @@ def polyVal(coeff, x):
         xn = xn * x
 
     return val
+
+# ... powerSums ...
+# Power sums S[j] = x[0]^j + x[1]^j + ... + x[m-1]^j for j = 0 .. n-1 modulo order
+# Powers are built incrementally (one multiplication per power) over plain integers
+def powerSums(x, n, order):
+    S = [0] * n
+    for xi in x:
+        xi = int(xi) % order
+        p = 1
+        for j in range(n):
+            S[j] += p
+            p = (p * xi) % order
+
+    return [Sj % order for Sj in S]
+
+# ... polyFromRoots ...
+# Same polynomial as formuleDeViete (coefficients from x^0 to x^n, coeff[n] = 1) but
+# modulo order over plain integers and in sub-quadratic time: the roots are split into
+# a product tree and two halves are multiplied by Kronecker substitution, i.e. both
+# polynomials are packed into big integers, multiplied by the interpreter (Karatsuba)
+# and unpacked.  Pays off for hundreds and thousands of roots.
+def polyFromRoots(roots, order):
+    P = [[(-int(x)) % order, 1] for x in roots]
+    if len(P) == 0:
+        return [1]
+
+    while len(P) > 1:
+        Q = []
+        for i in range(0, len(P) - 1, 2):
+            Q.append(polyMul(P[i], P[i + 1], order))
+        if len(P) % 2:
+            Q.append(P[-1])
+        P = Q
+
+    return P[0]
+
+# ... polyMul ...
+# Product of two polynomials with coefficients in [0, order), Kronecker substitution
+def polyMul(a, b, order):
+    n = min(len(a), len(b))
+    if n < 8:
+        c = [0] * (len(a) + len(b) - 1)
+        for i in range(len(a)):
+            for j in range(len(b)):
+                c[i + j] += a[i] * b[j]
+        return [x % order for x in c]
+
+# Every product coefficient is less than n*order^2, so it fits one slot
+    slot = (2 * order.bit_length() + n.bit_length() + 7) // 8
+    A = int.from_bytes(b''.join(x.to_bytes(slot, 'little') for x in a), 'little')
+    B = int.from_bytes(b''.join(x.to_bytes(slot, 'little') for x in b), 'little')
+    m = len(a) + len(b) - 1
+    C = (A * B).to_bytes(m * slot, 'little')
+    return [int.from_bytes(C[i * slot:(i + 1) * slot], 'little') % order for i in range(m)]
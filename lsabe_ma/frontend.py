@@ -13,37 +13,48 @@ from base64 import b64encode
 from .arguments import arguments_setup, dir_create
 from .lsabe_ma import LSABE_MA
 from .lsabe_authority import LSABE_AUTH
+from .serializer import MIME_BINARY
 from .feRoutines import *
 
 def startup():
 
+# Default for --max-keywords, the actual value is stored in PP by global setup
     MAX_KEYWORDS = 10
     parser = arguments_setup(MAX_KEYWORDS)
     args = parser.parse_args()
 
     if (not args.global_setup_flag and 
         not args.authority_setup_flag and 
+        not args.add_attributes_flag and 
+        args.policy is None and
         not args.keygen_flag and 
         not args.encrypt_flag and 
         not args.search_flag and 
         not args.clear_flag and
-        args.bulk_encrypt is None):
-        print('Nothing to do. Specify either --global-setup or --authority-setup or --keygen or --encrypt or --search or --bulk-encrypt.')
+        args.bulk_encrypt is None and
+        args.bulk_keygen is None and
+        args.precompute is None and
+        args.precompute_td is None):
+        print('Nothing to do. Specify either --global-setup or --authority-setup or --add-attributes or --policy or --keygen or --encrypt or --search or --bulk-encrypt or --bulk-keygen or --precompute or --precompute-trapdoors.')
         farewell()
 
     key_path = args.key_path
     dir_create(key_path)
 
-    lsabe_ma = LSABE_MA(key_path, MAX_KEYWORDS)
+    lsabe_ma = LSABE_MA(key_path, args.max_kw, curve = args.curve, binary = not args.text_format)
 
     if args.global_setup_flag:
-        globalSetup(lsabe_ma, args.url)
+        globalSetup(lsabe_ma, args)
     if args.authority_setup_flag:
-        lsabe_auth = authoritySetup(args.url, MAX_KEYWORDS)
+        lsabe_auth = authoritySetup(args, args.max_kw)
+    if args.add_attributes_flag:
+        lsabe_auth = addAttributes(args)
+    if args.policy is not None:
+        lsabe_auth = setPolicy(args)
 
 # SK generation
     if (args.keygen_flag):
-        lsabe_auth = tryAuthorityLoadOrExit(key_path, MAX_KEYWORDS, args.authority_id)
+        lsabe_auth = tryAuthorityLoadOrExit(key_path, args.max_kw, args.authority_id, not args.text_format)
         chekGIDorExit(args.GID)
 
         if len(args.attributes) == 0:
@@ -60,11 +71,71 @@ def startup():
             print('Failed to store SK to ' + str(sk_fname))
             farewell()
         print('SK saved to ' + str(sk_fname))
+# Trapdoor coupons made with previous SK are useless
+        tc_fname = tcFname(key_path, args.GID, args.authority_id)
+        if tc_fname.exists():
+            os.remove(tc_fname)
+
+# Bulk SK generation to the keystore
+    if args.bulk_keygen is not None:
+        lsabe_auth = tryAuthorityLoadOrExit(key_path, args.max_kw, args.authority_id, not args.text_format)
+        print('Executing bulk "SecretKeyGen(MSK,i,PP,GID,ASK(i,j))→SK(i,GID)" from file ' + str(args.bulk_keygen))
+        try:
+            file = open(args.bulk_keygen, 'r')
+            Lines = file.readlines()
+            file.close()
+        except:           
+            print('Failed to read file ' + str(args.bulk_keygen))
+            farewell()
 
-    if (args.encrypt_flag or args.search_flag) and len(args.keywords) > MAX_KEYWORDS:
-        print(str(len(args.keywords)) + ' keywords are provided. The maximum supported number of keywords is ' + str(MAX_KEYWORDS) + 
-              ' If you want to change it, please modify MAX_KEYWORDS value in the source code') 
-        farewell()
+        users = []
+        nLine = 0
+        for line in Lines:
+            nLine +=1
+            data = [d.strip() for d in line.strip().split(',')]
+            if not data[0] or len(data) < 2:
+                print('Line ' + str(nLine) +' -- no GID or no attributes, skipping.')
+            else:
+                users.append((data[0], data[1:]))
+
+        start = time.time()
+        try:
+            n = lsabe_auth.SecretKeyGenBulk(users, pathlib.Path(lsabe_auth.ks_fname), args.processes)
+        except:
+            print('Failed to store keys to ' + lsabe_auth.ks_fname)
+            farewell()
+        print(str(nLine) + ' lines processed. ' + str(n) + ' keys generated in ' + "{:,.2f}".format((time.time() - start) * 1000) + 
+              ' ms and saved to ' + lsabe_auth.ks_fname)
+# Trapdoor coupons made with previous SK are useless
+        for (GID, attrs) in users:
+            tc_fname = tcFname(key_path, GID, args.authority_id)
+            if tc_fname.exists():
+                os.remove(tc_fname)
+
+# Trapdoor coupons precomputation (offline part of trapdoor generation)
+    if args.precompute_td is not None:
+        lsabe_auth = tryAuthorityLoadOrExit(key_path, args.max_kw, args.authority_id, not args.text_format)
+        chekGIDorExit(args.GID)
+        SK = trySKLoadOrExit(lsabe_auth, key_path, args.GID, args.authority_id)
+        tc_fname = tcFname(key_path, args.GID, args.authority_id)
+        tryTrapdoorCouponsLoad(lsabe_auth, args.GID, tc_fname)
+        print('Executing "TrapdoorCouponGen({SKi},PP) → TC" ...')
+        start = time.time()
+        lsabe_auth.TrapdoorCouponsFill(SK, args.GID, args.precompute_td)
+        print(str(args.precompute_td) + ' coupons precomputed in ' + "{:,.2f}".format((time.time() - start) * 1000) + ' ms')
+        tryTrapdoorCouponsSave(lsabe_auth, args.GID, tc_fname)
+
+# Encryption coupons precomputation (offline part of encryption)
+    if args.precompute is not None:
+        lsabe_auth = tryAuthorityLoadOrExit(key_path, args.max_kw, args.authority_id, not args.text_format)
+        tryCouponsLoad(lsabe_auth)
+        print('Executing "EncryptionCouponGen(PP,{APK(i,j)}) → EC" ...')
+        start = time.time()
+        lsabe_auth.StartExecutor(args.processes)
+        n = lsabe_auth.CouponsFill(args.precompute)
+        lsabe_auth.StopExecutor()
+        print(str(n) + ' coupons precomputed in ' + "{:,.2f}".format((time.time() - start) * 1000) + ' ms')
+        tryCouponsSave(lsabe_auth)
 
 # Encrypt (file encryption and index generation)
     if (args.encrypt_flag):
@@ -73,24 +144,29 @@ def startup():
 
         print('Executing "Encrypt  (M,(A,ρ),KW,PP,{APK(i,j)})→CT." ...')
 
-        lsabe_auth = tryAuthorityLoadOrExit(key_path, MAX_KEYWORDS, args.authority_id)
+        lsabe_auth = tryAuthorityLoadOrExit(key_path, args.max_kw, args.authority_id, not args.text_format)
        
         if len(args.keywords) == 0:
             print('--encrypt flag is set but no keywords are supplied.\n'
                     'Encryption algorithm is defined as Encrypt(M,KW,(A,ρ),PP) → CT, where KW is a set of keywords.\n'
                     'Please provide at least one keyword. --kwd keyword will be good enouph')
             farewell()
+        checkKeywordsOrExit(lsabe_auth, args.keywords)
 
-        print('Message: \'' + str(args.message) + '\'' )    
+        print('Message: \'' + str(args.message) + '\'' )
         print('Keywords: ' + str(args.keywords))    
+        tryCouponsLoad(lsabe_auth)
+        lsabe_auth.StartExecutor(args.processes)
         Encrypt(lsabe_auth, args.message, args.keywords, args.url, data_path, False, 0)
+        lsabe_auth.StopExecutor()
+        tryCouponsSave(lsabe_auth)
 
 # Bulk encrypt messages    
     if args.bulk_encrypt is not None:
         data_path = args.data_path
         dir_create(data_path)
 
-        lsabe_auth = tryAuthorityLoadOrExit(key_path, MAX_KEYWORDS, args.authority_id)
+        lsabe_auth = tryAuthorityLoadOrExit(key_path, args.max_kw, args.authority_id, not args.text_format)
         print('Executing bulk encrypt from file ' + str(args.bulk_encrypt))
         try:
             file = open(args.bulk_encrypt, 'r')
@@ -99,6 +175,8 @@ def startup():
             print('Failed to read file ' + str(args.bulk_encrypt))
             farewell()
 
+        tryCouponsLoad(lsabe_auth)
+        lsabe_auth.StartExecutor(args.processes)
         nLine = 0
         nOk   = 0
         for line in Lines:
@@ -107,58 +185,82 @@ def startup():
             kwd = data[1:]
             if len(kwd) ==0:
                 print('\nLine ' + str(nLine) +' -- no keywords, skipping.')
+            elif len(kwd) > lsabe_auth.max_kw:
+                print('\nLine ' + str(nLine) +' -- ' + str(len(kwd)) + ' keywords, the maximum is ' + str(lsabe_auth.max_kw) + ', skipping.')
             else:    
                 if Encrypt(lsabe_auth, data[0], data[1:], args.url, data_path, True, nLine):
                     nOk += 1
         
+        lsabe_auth.StopExecutor()
         print('\n' + str(nLine) + ' lines processed. ' + str(nOk) + ' messages loaded.')
+        ci = lsabe_auth.KeywordCacheInfo()
+        print('Keyword hash cache: ' + str(ci['hash'].hits) + ' hits, ' + str(ci['hash'].misses) + ' misses. ' + 
+              'Keyword polynomial cache: ' + str(ci['poly'].hits) + ' hits, ' + str(ci['poly'].misses) + ' misses.')
+        tryCouponsSave(lsabe_auth)
 
 # Search (trapdoor generation, search, transformation, decription)
     if (args.search_flag):
-        lsabe_auth = tryAuthorityLoadOrExit(key_path, MAX_KEYWORDS, args.authority_id)
+        lsabe_auth = tryAuthorityLoadOrExit(key_path, args.max_kw, args.authority_id, not args.text_format)
         chekGIDorExit(args.GID)
 
         if len(args.keywords) == 0:
             print('--search flag is set but no keywords are supplied.\n'
                     'Please provide at least one keyword. --kwd keyword will be good enouph')
             farewell()
+        checkKeywordsOrExit(lsabe_auth, args.keywords)
 
         data_path = args.data_path
         dir_create(data_path)
 
-        sk_fname = key_path.joinpath(args.GID + '-authority-' + str(args.authority_id) + '.sk')   
+        SK = trySKLoadOrExit(lsabe_auth, key_path, args.GID, args.authority_id)
+# SK records its attributes, SK files of earlier versions need --sec-attr
+        if lsabe_auth.policy is not None and len(args.attributes) == 0 and SK.attrs is None:
+            print('authority-' + str(args.authority_id) + ' access policy is "' + lsabe_auth.policy + '". '
+                    'Please provide security attributes of the user. --sec-attr attribute will be good enouph')
+            farewell()
         try:
-            SK = lsabe_auth.deserialize__SK(sk_fname)
-        except:
-           print('Failed to load SK from ' + str(sk_fname))
-           farewell()
-        print('SK loaded from ' + str(sk_fname))
+            attrs = lsabe_auth.KeyAttributes(args.attributes, SK)
+        except ValueError as e:
+            print(str(e) + '. Please check --sec-attr or generate SK again.')
+            farewell()
+        tc_fname = tcFname(key_path, args.GID, args.authority_id)
+        tryTrapdoorCouponsLoad(lsabe_auth, args.GID, tc_fname)
+
+        degree = None
+        if args.url is not None:
+            degree = tryCorpusDegree(args.url)
 
         print('Executing "Trapdoor ({SKi,GID},KW′,PP) → TKW′" ...')
         start = time.time()
-        TD = lsabe_auth.TrapdoorGen(SK, args.GID, args.keywords) 
+        TD = lsabe_auth.TrapdoorGen(SK, args.GID, args.keywords, degree = degree) 
         trapdoor_gen_time = (time.time() - start) * 1000
+        tryTrapdoorCouponsSave(lsabe_auth, args.GID, tc_fname)
         print('Executing "TransKeyGen({SKi,GID},z) → TKGID" ...')
         start = time.time()
-        z =  lsabe_ma.z()
+        z =  lsabe_auth.z()
         TK = lsabe_auth.TransKeyGen(SK, z, args.GID)
         transkey_gen_time = (time.time() - start) * 1000
 
         if args.url is None:
             print('No URL provided, scanning local files at  ' + str(data_path) + ' ...')
             msg_files = [f for f in os.listdir(str(data_path)) if f.endswith('.ciphertext')]
+            Q = lsabe_auth.PrepareQuery(TD, TK, attrs)
             for msg_file in msg_files:
                 ct_fname = data_path.joinpath(msg_file)   
-                CT = lsabe_auth.deserialize__CT(ct_fname)
+                CT = lsabe_auth.deserialize__CT(ct_fname, lazy = True)
+                try:
+                    A = lsabe_auth.deserialize__CTA(ct_fname.with_suffix('.aggregate'))
+                except:
+                    A = None
                 print('===== ' + msg_file + ' =====')
                 print('Executing "Search(CT,TD) → True/False" ...')
 
-                res = lsabe_auth.Search(CT, TD)
+                res = lsabe_auth.SearchPrepared(CT, Q, A)
                 print('Search algoritm returned "' + str(res) + '"')
 
                 if res:
                     print('Executing "Transform (CT,TKGID) → CTout/⊥" ...')
-                    CTout = lsabe_auth.Transform(CT, TK)   
+                    CTout = lsabe_auth.TransformPrepared(CT, Q, A)
 
                     print('Executing "Decrypt(z,CTout) → M" ...')
                     msg = lsabe_auth.Decrypt(z, CTout)
@@ -166,52 +268,65 @@ def startup():
 
         else:
             print('Sending search request to: ' + str(args.url))
-            try:    
-                tds = io.BytesIO()
-                lsabe_auth.serialize__TD(TD, tds, False)
-
-                tks = io.BytesIO()
-                lsabe_auth.serialize__TK(TK, tks, False)
-                response = requests.get(args.url + "/search", 
-                            files={'TD': tds.getvalue(), 'TK': tks.getvalue()})
-
-                tds.close()
-                tks.close()
-            except:
-                print('Failed to send search request to ' + str(args.url) + ' Please ensure that the server is running.')
-                farewell()
-
-            nmsg = 0
-            if response.text is not None:
-                if response.status_code==200:
-                    try:
-                        rsp = response.json()                    
-                        nmsg= len(rsp['CTout'])     
-                        t = str(nmsg) + ' partially decrypted messages received.'
-                    except:
-                        print('Failed to parse server response.')
-                        farewell()
-                else:    
-                    t = response.text
-            else:
-                t = ""
-
-            print('Server response ' + str(response.status_code) + '(' + response.reason + '). ' + t)
-
-            if nmsg>0:
+            response = trySearchRequestOrExit(lsabe_auth, args.url, TD, TK, attrs)
+
+# Documents with more keywords were stored after the degree was read: the trapdoor is
+# generated again for the current degree (with a fresh coupon, the pool is saved already)
+            degree = staleDegree(response)
+            if degree is not None:
+                print('Server corpus trapdoor degree is ' + str(degree) + ' now.')
+                print('Executing "Trapdoor ({SKi,GID},KW′,PP) → TKW′" ...')
+                start = time.time()
+                TD = lsabe_auth.TrapdoorGen(SK, args.GID, args.keywords, lsabe_auth.TrapdoorCouponGen(SK), degree = degree) 
+                trapdoor_gen_time += (time.time() - start) * 1000
+                response = trySearchRequestOrExit(lsabe_auth, args.url, TD, TK, attrs)
+
+# Streamed response: partially decrypted messages are decrypted as they arrive
+            content_type = response.headers.get('Content-Type', '')
+            if response.status_code==200 and (content_type.startswith('application/x-ndjson') or content_type.startswith(MIME_BINARY)):
+                print('Server response ' + str(response.status_code) + '(' + response.reason + '). Receiving partially decrypted messages ...')
                 print('Executing "Decrypt(z,CTout) → M" ...')
-                decryption_time = 0
-                for CTout in rsp['CTout']:
-                    try:
-                        CTout2 = lsabe_auth.deserialize__CTout(bytes(CTout, 'utf-8'), False)
-                        tm = time.time()
-                        msg = lsabe_auth.Decrypt(z, CTout2)
-                        decryption_time += (time.time() - tm)
-                        print('Message: \"' + msg + '\"' )
-                    except:
-                        print('Failed to decrypt a message.')
-                decryption_time *= 1000
-                print_evaluation_results(rsp, nmsg, trapdoor_gen_time, transkey_gen_time, decryption_time)
+                rsp = {}
+                start = time.time()
+                try:
+                    CTouts = binaryCTouts(response, rsp) if content_type.startswith(MIME_BINARY) else ndjsonCTouts(response, rsp)
+                    for msg in lsabe_auth.DecryptIter(z, CTouts):
+                        printMessage(msg)
+                except:
+                    print('Failed to parse server response.')
+                    farewell()
+                decryption_time = (time.time() - start - rsp.get('receive_time', 0)) * 1000
+                nmsg = rsp.get('nmsg', 0)
+                if nmsg>0:
+                    print_evaluation_results(rsp, nmsg, trapdoor_gen_time, transkey_gen_time, decryption_time)
+                else:
+                    print('Message was not found.')
+            else:
+                nmsg = 0
+                if response.text is not None:
+                    if response.status_code==200:
+                        try:
+                            rsp = response.json()                    
+                            nmsg= len(rsp['CTout'])     
+                            t = str(nmsg) + ' partially decrypted messages received.'
+                        except:
+                            print('Failed to parse server response.')
+                            farewell()
+                    else:    
+                        t = response.text
+                else:
+                    t = ""
+
+                print('Server response ' + str(response.status_code) + '(' + response.reason + '). ' + t)
+
+                if nmsg>0:
+                    print('Executing "Decrypt(z,CTout) → M" ...')
+                    tm = time.time()
+                    msgs = lsabe_auth.DecryptMany(z, rsp['CTout'], args.processes)
+                    decryption_time = (time.time() - tm) * 1000
+                    for msg in msgs:
+                        printMessage(msg)
+                    print_evaluation_results(rsp, nmsg, trapdoor_gen_time, transkey_gen_time, decryption_time)
 
 # Delete all message files
     if (args.clear_flag):
@@ -222,6 +337,11 @@ def startup():
 
             msg_files = [f for f in os.listdir(str(data_path)) if f.endswith('.ciphertext')]
             print('Deleting ' + str(len(msg_files)) + ' message files')
+            for cta_file in [f for f in os.listdir(str(data_path)) if f.endswith('.aggregate')]:
+                try:
+                    os.remove(data_path.joinpath(cta_file))
+                except:
+                    pass
             nDel = 0
             for msg_file in msg_files:
                 try:
@@ -275,6 +395,7 @@ def Encrypt(auth, msg, kwd, url, data_path, bulk, nLine):
         ct_fname = data_path.joinpath(ct_name + '.ciphertext')   
         try:
             auth.serialize__CT(CT, ct_fname)
+            auth.serialize__CTA(auth.AggregateGen(CT), ct_fname.with_suffix('.aggregate'))
         except:
             print(m + 'Failed to store ciphertext to ' + str(ct_fname))
             bOk = False
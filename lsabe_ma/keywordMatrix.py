@@ -0,0 +1,75 @@
+# .... LSABE keyword coefficient matrix ...
+# keywordMatrix - I5 (keyword polynomial coefficients) of all stored ciphertexts kept as
+#                 column-oriented matrix of integers modulo the group order:
+#                 M[j][c] = I5[j] of ciphertext c or 0 if ciphertext c has less coefficients.
+#
+# Search needs T4m = Σ I5[j]*T4[j] for every ciphertext.  product(T4) computes it for the
+# whole corpus as one modular matrix-vector product over plain integers instead of
+# len(I5) ZR multiplications and additions per ciphertext.  NumPy object arrays are used
+# if NumPy is available, otherwise the product is evaluated row by row with lists.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class keywordMatrix:
+    def __init__(self, group):
+        self.__r = group.order()
+        self._keys = []                 # ciphertext (column) keys in column order
+        self._pos = {}                  # key -> column
+        self._M = []                    # rows (coefficient index j) of columns
+        self.__np = None                # NumPy snapshot of self._M
+
+    def __len__(self):
+        return len(self._keys)
+
+# The highest number of I5 coefficients in the corpus
+    @property
+    def degree(self):
+        return len(self._M)
+
+    def position(self, key):
+        return self._pos[key]
+
+    def add(self, key, I5):
+        if key in self._pos:
+            return
+        c = len(self._keys)
+        while len(self._M) < len(I5):
+            self._M.append([0] * c)
+        for j in range(len(self._M)):
+            self._M[j].append(int(I5[j]) % self.__r if j < len(I5) else 0)
+        self._pos[key] = c
+        self._keys.append(key)
+        self.__np = None
+
+    def clear(self):
+        self._keys = []
+        self._pos = {}
+        self._M = []
+        self.__np = None
+
+# T4 is trapdoor T4 (ZR elements or integers), at least degree values: a shorter 
+# trapdoor does not cover I5 of the longest ciphertexts (ValueError)
+# Returns T4m (integer) for every column, in column order
+    def product(self, T4):
+        n = len(self._keys)
+        k = len(self._M)
+        if len(T4) < k:
+            raise ValueError('Trapdoor has ' + str(len(T4)) + ' T4 values, the corpus degree is ' + str(k))
+        t = [int(T4[j]) % self.__r for j in range(k)]
+
+        if numpy is not None and n > 0:
+            if self.__np is None:
+                self.__np = [numpy.array(row, dtype=object) for row in self._M]
+            acc = numpy.zeros(n, dtype=object)
+            for j in range(k):
+                acc = acc + self.__np[j] * t[j]
+            return [int(v) % self.__r for v in acc]
+
+        acc = [0] * n
+        for j in range(k):
+            tj = t[j]
+            acc = [a + m * tj for a, m in zip(acc, self._M[j])]
+        return [v % self.__r for v in acc]
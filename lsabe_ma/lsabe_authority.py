@@ -1,15 +1,23 @@
 import os
+import io
 import sys
 import random
 from pathlib import Path
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # https://jhuisi.github.io/charm/cryptographers.html
 from charm.toolbox.pairinggroup import PairingGroup,ZR,G1,G2,GT,pair,extract_key
 
-from .formuleDeViete import formuleDeViete, polyVal
+from .formuleDeViete import polyVal, powerSums
 from .symcrypto import SymmetricCryptoAbstraction
-from .serializer import SER, DES
+from .serializer import SER, DES, HEADER
 from .accessPolicy import accessPolicy
+from .fixedBase import fixedBase
+from .multiExp import multiExp
+from .ctView import ctView, I2_tuple
+from .records import ciphertext, trapdoor, transKey, ctOut, aggregates, secretKey
 
 from .lsabe_ma import LSABE_MA
 
@@ -17,13 +25,31 @@ from .lsabe_ma import LSABE_MA
 # LSABE-MA Authority
 
 class LSABE_AUTH(LSABE_MA): 
-    def __init__(self, msk_path, max_kw, id):
-        LSABE_MA.__init__(self, msk_path, max_kw)
+# ec_max - encryption coupon pool capacity
+# binary - see LSABE_MA
+    def __init__(self, msk_path, max_kw, id, ec_max = 1000, binary = True):
+        LSABE_MA.__init__(self, msk_path, max_kw, binary = binary)
         LSABE_MA.GlobalLoad(self)
+        self._msk_path = msk_path
+        self._id = id
 
         self._att_fname = msk_path.joinpath('authority-' + str(id) + '.att')   
         self._ask_fname = msk_path.joinpath('authority-' + str(id) + '.ask')
         self._apk_fname = msk_path.joinpath('authority-' + str(id) + '.apk')
+# Encryption coupon pool
+        self._ecp_fname = msk_path.joinpath('authority-' + str(id) + '.ecp')
+# Keystore of bulk key generation
+        self._ks_fname = msk_path.joinpath('authority-' + str(id) + '.ks')
+# Access policy (the stub if there is no such file)
+        self._pol_fname = msk_path.joinpath('authority-' + str(id) + '.pol')
+        self._ec_max = ec_max
+        self._EC = deque()
+# Trapdoor coupon pools: GID -> pool
+        self._TC = {}
+# Encryption executor (StartExecutor)
+        self._pool = None
+        self._processes = None
+        self._rows_min = None
 
     @property
     def att_fname(self):
@@ -37,6 +63,22 @@ class LSABE_AUTH(LSABE_MA):
     def apk_fname(self):
         return str(self._apk_fname)
 
+    @property
+    def ecp_fname(self):
+        return str(self._ecp_fname)
+
+    @property
+    def ks_fname(self):
+        return str(self._ks_fname)
+
+    @property
+    def pol_fname(self):
+        return str(self._pol_fname)
+
+    @property
+    def policy(self):
+        return self._ap.policy
+
 # ................................................................................
 # AuthoritySetup (PP)→(APK(i,j),ASK(i,j)). Each authority A(j) conducts the authority
 # setup algorithm, which inputs public parameter PP and generates an attribute public  
@@ -44,20 +86,11 @@ class LSABE_AUTH(LSABE_MA):
 # ................................................................................
 # AuthoritySetup
 # ................................................................................
-    def AuthoritySetup(self, attrs):
-        self._ATT = ()
-        self._ASK = ()
-        self._APK = ()
-        for attr in attrs:
-            ATTi = attr 
-            alfa, y = random.randrange(sys.maxsize), random.randrange(sys.maxsize)
-            beta = self.group.random(ZR)
-            ASKi = {'alfa': alfa, 'y': y, 'beta': beta }
-            APKi = { 'e(gg)^alfa' : pair(self._PP['g'], self._PP['g']) ** alfa, 'g**y': self._PP['g']**y, 'g**beta': self._PP['g']**beta }
-
-            self._ATT = self._ATT + (ATTi, )
-            self._ASK = self._ASK + (ASKi, )
-            self._APK = self._APK + (APKi, )
+    def AuthoritySetup(self, attrs, processes = None):
+        (ASK, APK) = self.__attribute_keys(len(attrs), processes)
+        self._ATT = tuple(attrs)
+        self._ASK = tuple(ASK)
+        self._APK = tuple(APK)
 
 #        print("Authority attributes:")
 #        print(self._ATT)
@@ -67,31 +100,160 @@ class LSABE_AUTH(LSABE_MA):
 #        print(self._APK)
 
         self.__serialize_A()
+        self.__index_A()
+# Coupons made with previous authority keys are useless
+        self._EC.clear()
+        if self._ecp_fname.exists():
+            os.remove(self._ecp_fname)
+# New authority starts with the default access policy
+        self._ap = accessPolicy()
+        if self._pol_fname.exists():
+            os.remove(self._pol_fname)
+        self.__restart_executor()
+
+# ................................................................................
+# AuthorityAddAttributes (PP)→(APK(i,j),ASK(i,j)) for new attributes of the loaded 
+# authority. Keys of existing attributes, user keys and coupons stay valid; records of 
+# the new attributes are appended to the key files and the attribute count is updated  
+# in place. Attributes that the authority already manages are skipped.
+# Returns the number of added attributes
+# ................................................................................
+    def AuthorityAddAttributes(self, attrs, processes = None):
+        attrs = [a for a in dict.fromkeys(attrs) if a not in self._ATTI]
+        if len(attrs) == 0:
+            return 0
+        n0 = len(self._ATT)
+
+        (ASK, APK) = self.__attribute_keys(len(attrs), processes)
+        self._ATT = self._ATT + tuple(attrs)
+        self._ASK = self._ASK + tuple(ASK)
+        self._APK = self._APK + tuple(APK)
+
+        sz = len(self._ATT)
+        if all(SER.update_size(f, sz) for f in (self._att_fname, self._ask_fname, self._apk_fname)):
+            self.__serialize_A(n0)
+        else:
+            self.__serialize_A()
+        for s in range(n0, sz):
+            self._ATTI.setdefault(self._ATT[s], s)
+        self.__restart_executor()
+        return len(attrs)
+
+# ASK and APK for n new attributes.
+# Random values are generated here, public keys are computed by a pool of worker 
+# processes if processes is set (by chunks of 256 attributes). APK fixed-base tables
+# are not built at setup, see APKpow
+    def __attribute_keys(self, n, processes):
+        ASK = []
+        for i in range(n):
+            alfa, y = random.randrange(sys.maxsize), random.randrange(sys.maxsize)
+            beta = self.group.random(ZR)
+            ASK.append({'alfa': alfa, 'y': y, 'beta': beta })
+
+        K = [(ASKi['alfa'], ASKi['y'], int(ASKi['beta'])) for ASKi in ASK]
+        if processes is None or processes < 2 or n < 512:
+            R = _attribute_keys(self, K)
+        else:
+            R = []
+            with ProcessPoolExecutor(processes, initializer = _setup_init, 
+                                     initargs = (self._msk_path, self._max_kw)) as pool:
+                for b in pool.map(_setup_chunk, [K[i:i + 256] for i in range(0, n, 256)]):
+                    l = DES(b, self.group, False)
+                    while not l.eof():
+                        APKi = {}
+                        APKi['e(gg)^alfa'], APKi['g**y'], APKi['g**beta'] = l.g_val(3)
+                        R.append(APKi)
+
+        return (ASK, R)
 
     def AuthorityLoad(self):
         self.__deserialize_A()
+        self.__index_A()
+        self.PolicyLoad()
+
+# ................................................................................
+#  Access policy (A,ρ) of the authority
+#  AuthorityPolicy compiles boolean policy over the attributes managed by the authority,
+#  e.g. "(doctor and cardiology) or admin", and stores it to authority-N.pol. 
+#  None restores the default (stub) policy. Coupons made for other policy are dropped.
+#  PolicyLoad loads the policy only, so the storage server (that needs (A,ρ) but no 
+#  authority keys) may call it without AuthorityLoad
+# ................................................................................
+    def AuthorityPolicy(self, policy):
+        if policy is None:
+            ap = accessPolicy()
+        else:
+            ap = accessPolicy(policy, self.group.order())
+            for i in range(ap.l):
+                if ap.p(i) not in self._ATTI:
+                    raise ValueError('Attribute ' + ap.p(i) + ' is not managed by the authority')
+
+        self._ap = ap
+        if policy is None:
+            if self._pol_fname.exists():
+                os.remove(self._pol_fname)
+        else:
+            SER(self._pol_fname, self.group, binary = self._binary).p_str(policy)
+
+        self._EC.clear()
+        if self._ecp_fname.exists():
+            os.remove(self._ecp_fname)
+
+    def PolicyLoad(self):
+        if self._pol_fname.exists():
+            self._ap = accessPolicy(DES(self._pol_fname, self.group).g_str(), self.group.order())
+        else:
+            self._ap = accessPolicy()
+
+# User attributes in the order of SK entries (i.e. in the order of authority attributes),
+# that is how PrepareQuery expects them.  SK records the attributes it was issued for, 
+# attrs (if any) shall be the same set. SK of earlier versions does not, then attrs are 
+# required and shall provide an attribute for every SK entry. ValueError otherwise
+    def KeyAttributes(self, attrs, SK = None):
+        K = getattr(SK, 'attrs', None)
+        if K is not None:
+            if attrs and set(attrs) != set(K):
+                raise ValueError('Attributes ' + ', '.join(attrs) + ' do not match the attributes of SK: ' + ', '.join(K))
+            return list(K)
+        K = [self._ATT[s] for s in sorted(self._ATTI[a] for a in attrs if a in self._ATTI)]
+        if SK is not None and len(K) != len(SK):
+            raise ValueError('SK has ' + str(len(SK)) + ' attribute keys, ' + str(len(K)) + ' attributes are provided')
+        return K
+
+# Attribute -> index map, per-attribute g^alfa cache (filled by SecretKeyGen on demand)
+# and APK fixed-base tables (filled by APKpow on demand)
+    def __index_A(self):
+        self._ATTI = {}
+        for s in range(len(self._ATT)):
+            self._ATTI.setdefault(self._ATT[s], s)
+        self._GA = {}
+        self._APKT = {}
+        self._APKN = {}
 
 # ................................................................................
 #  Authority serializer and deserializer
+#  n0 > 0 - append records starting from n0 to existing files (sizes are updated by 
+#  AuthorityAddAttributes)
 # ................................................................................
 
-    def __serialize_A(self):
-        att_f = SER(self._att_fname, self.group)
-        ask_f = SER(self._ask_fname, self.group)
-        apk_f = SER(self._apk_fname, self.group)
+    def __serialize_A(self, n0 = 0):
+        att_f = SER(self._att_fname, self.group, append = n0 > 0, binary = self._binary)
+        ask_f = SER(self._ask_fname, self.group, append = n0 > 0, binary = self._binary)
+        apk_f = SER(self._apk_fname, self.group, append = n0 > 0, binary = self._binary)
 
-        sz = len(self._ATT)
-        att_f.p_size(sz)
-        ask_f.p_size(sz)
-        apk_f.p_size(sz)
+        if n0 == 0:
+            sz = len(self._ATT)
+            att_f.p_size(sz)
+            ask_f.p_size(sz)
+            apk_f.p_size(sz)
 
-        for ATTi in self._ATT:
+        for ATTi in self._ATT[n0:]:
             att_f.p_str(ATTi)
 
-        for ASKi in self._ASK:
+        for ASKi in self._ASK[n0:]:
             ask_f.p_int(ASKi['alfa']).p_int(ASKi['y']).p_val((ASKi['beta'], ))
 
-        for APKi in self._APK:
+        for APKi in self._APK[n0:]:
             apk_f.p_val(APKi.values())
 
     def __deserialize_A(self):
@@ -103,16 +265,20 @@ class LSABE_AUTH(LSABE_MA):
         sz = ask_f.g_size()
         sz = apk_f.g_size()
 
-        self._ATT = ()
-        self._ASK = ()
-        self._APK = ()
+        ATT = []
+        ASK = []
+        APK = []
 
         for i in range(sz):
-            self._ATT = self._ATT + (att_f.g_str(), ) 
-            self._ASK = self._ASK + ({'alfa': ask_f.g_int(), 'y': ask_f.g_int(), 'beta': ask_f.g_val(1)[0]}, )          
+            ATT.append(att_f.g_str()) 
+            ASK.append({'alfa': ask_f.g_int(), 'y': ask_f.g_int(), 'beta': ask_f.g_val(1)[0]})          
             APKi = {}
             APKi['e(gg)^alfa'], APKi['g**y'], APKi['g**beta'] = apk_f.g_val(3)  
-            self._APK = self._APK + (APKi, )
+            APK.append(APKi)
+
+        self._ATT = tuple(ATT)
+        self._ASK = tuple(ASK)
+        self._APK = tuple(APK)
 
 #        print("Authority attributes:")
 #        print(self._ATT)
@@ -123,6 +289,27 @@ class LSABE_AUTH(LSABE_MA):
 #        print("Authority public key:")
 #        print(self._APK)
 
+# ................................................................................
+#  APKpow
+#  Exponentiation of APK e(g,g)^alfa of attribute s.  A GT fixed-base table costs about
+#  as much as three exponentiations and takes some hundred kilobytes, so it is built 
+#  when the attribute is exponentiated for the _APKT_MIN-th time (encryption coupons, 
+#  bulk encryption) and kept in memory.  Attributes that are not encrypted to, and the 
+#  processes that do not encrypt (key generation, search, transform), have no tables
+# ................................................................................
+    _APKT_MIN = 4
+
+    def APKpow(self, s, e):
+        t = self._APKT.get(s)
+        if t is None:
+            n = self._APKN.get(s, 0) + 1
+            if n < self._APKT_MIN:
+                self._APKN[s] = n
+                return self._APK[s]['e(gg)^alfa'] ** e
+            t = self._APKT[s] = fixedBase(self.group, self._APK[s]['e(gg)^alfa'])
+            del self._APKN[s]
+        return t.pow(e)
+
 # ................................................................................
 # SecretKeyGen(MSK,i,PP,GID,ASK(i,j))→SK(i,GID). 
 # Given PP,GID, an attribute i belonging to a certain authority, and the attribute 
@@ -130,52 +317,138 @@ class LSABE_AUTH(LSABE_MA):
 # a secret key SK(i,GID) for this attribute and sends it to the data user.
 # ................................................................................
     def SecretKeyGen(self, GID, attrs):
+        return self.SecretKeyGenMany(((GID, attrs), ))[0]
+
+# ................................................................................
+#  SecretKeyGenMany({GID,{attrs}}) → {SK(i,GID)}.  
+#  Keys for a batch of users. Attributes are looked up by attribute -> index map, 
+#  g^alfa is computed once per attribute and 1/(lambda + H(GID)) of all users of the 
+#  batch takes a single modular inversion (Montgomery batch inversion)
+# ................................................................................
+    def SecretKeyGenMany(self, users):
+        r = self.group.order()
+        lmbda = int(self._MSK['lambda'])
 
 # The aricles says H: {0,1}* --> G, i.e.: hGID = self.group.hash(GID, G1)
 # However, it won't work since T4 = H(HID) and I0^T4 is used in Search operation
 # I believe that  power is not defined on GxG. 
 # Anyway H: {0,1}* --> ZR* does not make anythging worse
-        hGID = self.group.hash(GID, ZR)
-        HGID = self.group.hash(GID, G1)
-
-        SK = ()
- 
-        for s in range(len(self._ATT)):
-            for a2 in attrs:
-                if self._ATT[s]==a2:
+        D = [(lmbda + int(self.group.hash(GID, ZR))) % r for (GID, attrs) in users]
+        P = [1] * (len(D) + 1)
+        for u in range(len(D)):
+            P[u + 1] = (P[u] * D[u]) % r
+        inv = pow(P[len(D)], -1, r) if len(D) > 0 else 1
+        DI = [0] * len(D)
+        for u in range(len(D) - 1, -1, -1):
+            DI[u] = (inv * P[u]) % r
+            inv = (inv * D[u]) % r
+
+        R = []
+        for u in range(len(users)):
+            (GID, attrs) = users[u]
+            HGID = self.group.hash(GID, self._GK)
+            SK = []
+            S = sorted(set(self._ATTI[a] for a in attrs if a in self._ATTI))
+            for s in S:
 #   The article says K1 = g^(alfa/(lambda+delta)), but it makes no sense since delta is not defined
 #   It looks like copy-paste from LSABE 
 #   Algorith works if K1 = g^(alfa/(lambda + H(GID))) -- both if formula is checked and implemented in sw                 
-                    K1 = self._PP['g'] ** (self._ASK[s]['alfa']/(self._MSK['lambda'] + hGID))
-                    K3 = HGID ** self._ASK[s]['y']
-                    K4 = (self._PP['g'] ** self._ASK[s]['alfa']) * (HGID ** self._ASK[s]['beta'])
-                    SKs = (K1, K3, K4)
-#                    print("Secret key [" + a2 + "]:")
-#                    print(K1, K3, K4)
-                    SK = SK + (SKs, )
+                ASKs = self._ASK[s]
+                if s not in self._GA:
+                    self._GA[s] = self.PPpow('g2', ASKs['alfa'])
+                K1 = self.PPpow('g2', ASKs['alfa'] * DI[u])
+                K3 = HGID ** ASKs['y']
+                K4 = self._GA[s] * (HGID ** ASKs['beta'])
+                SK.append((K1, K3, K4))
+            R.append(secretKey(SK, [self._ATT[s] for s in S]))
 
-        return SK 
+        return R
+
+# ................................................................................
+#  SecretKeyGenBulk({GID,{attrs}}) → keystore
+#  Bulk key generation to a single keystore file (see serialize__KS). Users are split 
+#  into chunks of the given size; chunks are processed by a pool of worker processes if
+#  processes is set. Every worker loads the authority from msk_path once. 
+#  Returns the number of keys generated
+# ................................................................................
+    def SecretKeyGenBulk(self, users, ks_fname, processes = None, chunk = 512):
+        users = list(users)
+        C = [users[i:i + chunk] for i in range(0, len(users), chunk)]
+
+        with ks_fname.open(mode='wb') as f:
+            if self._binary:
+                f.write(HEADER)
+            if processes is None or processes < 2 or len(C) < 2:
+                for c in C:
+                    f.write(self.serialize__KS(c, self.SecretKeyGenMany(c)))
+            else:
+                with ProcessPoolExecutor(processes, initializer = _keygen_init, 
+                                         initargs = (self._msk_path, self._max_kw, self._id, self._binary)) as pool:
+                    for b in pool.map(_keygen_chunk, C):
+                        f.write(b)
+
+        return len(users)
 
 # ................................................................................
 #  SK serializer and deserializer
+#  (K1, K3, K4) of every attribute are followed by the attribute names (SK.attrs); 
+#  SK files of earlier versions end after the keys
 # ................................................................................
     def serialize__SK(self, SK, sk_fname):
-        l = SER(sk_fname, self.group)
-        sz = len(SK)
-        l.p_size(sz)
-        for SKs in SK:
-            (K1, K3, K4) = SKs
-            l.p_val((K1,K3,K4))
+        self.__p_SK(SER(sk_fname, self.group, binary = self._binary), SK)
 
     def deserialize__SK(self, sk_fname):
-        SK = ()
-        l = DES(sk_fname, self.group)
+        return self.__g_SK(DES(sk_fname, self.group))
+
+    def __p_SK(self, l, SK):
+        l.p_size(len(SK))
+        for (K1, K3, K4) in SK:
+            l.p_val((K1, K3, K4))
+        for a in getattr(SK, 'attrs', None) or ():
+            l.p_str(a)
+        return l
+
+    def __g_SK(self, l, attrs = None):
         sz = l.g_size()
-        for s in range(sz):
-            SKs = l.g_val(3)
-            SK = SK + (SKs, )
-#            print(SKs)
-        return SK 
+        K = tuple(l.g_val(3) for s in range(sz))
+        if attrs is None:
+            attrs = not l.eof()
+        return secretKey(K, tuple(l.g_str() for s in range(sz)) if attrs else None)
+
+# ................................................................................
+#  Keystore serializer and deserializer
+#  Keystore is a sequence of records (GID, SK) in SK file format, no header, so records
+#  of independently serialized chunks can be concatenated (binary keystore file starts 
+#  with the header, see SecretKeyGenBulk). Every SK record has the attribute names
+# ................................................................................
+    def serialize__KS(self, users, SKs):
+        ks = io.BytesIO()
+        l = SER(ks, self.group, False, binary = self._binary, header = False)
+        for u in range(len(users)):
+            self.__p_SK(l.p_str(users[u][0]), SKs[u])
+        return ks.getvalue()
+
+# Returns GID -> SK or SK of the given GID (None if it is not in the keystore).
+# The last record wins if GID is stored more than once.  Looking for the given GID, 
+# the keys of other records are skipped, not decoded
+    def deserialize__KS(self, ks_fname, GID = None):
+        l = DES(ks_fname, self.group)
+        KS = {}
+        pos = None
+        while not l.eof():
+            g = l.g_str()
+            if GID is None:
+                KS[g] = self.__g_SK(l, True)
+                continue
+            if g == GID:
+                pos = l.tell()
+            sz = l.g_size()
+            l.skip_val(3 * sz).skip_str(sz)
+        if GID is None:
+            return KS
+        if pos is None:
+            return None
+        return self.__g_SK(l.seek(pos), True)
 
 # ................................................................................
 # TransKeyGen({SKi,GID},z) → TKGID. 
@@ -184,25 +457,21 @@ class LSABE_AUTH(LSABE_MA):
 # ................................................................................
     
     def TransKeyGen(self, SK, z, GID):
-        TK2 = self.group.hash(GID, G1) ** z
-        TK3 = ()
-        TK4 = ()
-        for SKs in SK:
-            (K1, K3, K4) = SKs  
-            TK3 = TK3 + (K3 ** z, )
-            TK4 = TK4 + (K4 ** z, ) 
+        TK2 = self.group.hash(GID, self._GK) ** z
+        TK3 = tuple(K3 ** z for (K1, K3, K4) in SK)
+        TK4 = tuple(K4 ** z for (K1, K3, K4) in SK)
 
 #        print ("Transformation key:")
 #        print ((TK2, TK3, TK4))
 
-        return (TK2, TK3, TK4)
+        return transKey(TK2, TK3, TK4)
 
 # ................................................................................
 #  TK serializer and deserializer
 # ................................................................................
     def serialize__TK(self, TK, tk_fname, open = True):
         (TK2, TK3, TK4) = TK
-        l = SER(tk_fname, self.group, open)
+        l = SER(tk_fname, self.group, open, binary = self._binary)
         l.p_val((TK2, ))
         sz = len(TK3)
         l.p_size(sz)
@@ -212,128 +481,370 @@ class LSABE_AUTH(LSABE_MA):
     def deserialize__TK(self, sk_fname, open = True):
         l = DES(sk_fname, self.group, open)
         TK2 = l.g_val(1)[0]
-        TK3 = ()
-        TK4 = ()
         sz = l.g_size()
-        for i in range(sz):
-            (TK3i, TK4i) = l.g_val(2)
-            TK3 = TK3 + (TK3i, )
-            TK4 = TK4 + (TK4i, )
+        TK34 = [l.g_val(2) for i in range(sz)]
+        TK3 = tuple(TK3i for (TK3i, TK4i) in TK34)
+        TK4 = tuple(TK4i for (TK3i, TK4i) in TK34)
 #        print((TK2, TK3, TK4))
-        return (TK2, TK3, TK4)
+        return transKey(TK2, TK3, TK4)
+
+# ................................................................................
+# EncryptionCouponGen(PP,{APK(i,j)}) → EC.  
+# Offline part of Encrypt. Everything driven by the random values UpsilonWithHook,  
+# rho1, b and s (r(i) of a compiled policy) does not depend on the message and the 
+# keywords, so it can be computed in advance (e.g. when IIoT gateway is idle). 
+# A coupon holds the AES key of the future ciphertext and shall be used only once.
+# ................................................................................
+    def EncryptionCouponGen(self):
+        rho1, b = self.group.random(ZR), self.group.random(ZR)
+
+        v = self._ap.randVector()
+        I0 = self.PPpow('g', b)
+        I1 = self.PPpow('g', self._MSK['lambda']*b)
+        I3 = self.PPpow('g', rho1)
+
+# Compiled policy (Lewko-Waters): UpsilonWithHook = e(g,g)^v[0] is shared by the rows of
+# A, and 0 is shared by ω(i) = A(i)·o.  Every row has its own random r(i):
+#   I(i)  = e(g,g)^λ(i) * e(g,g)^(alfa*r(i))     I2(i) = g^r(i)
+#   I4(i) = g^(beta*r(i) + rho1*y + ω(i))
+# so a row is opened with K4 = g^alfa * H(GID)^beta and H(GID) of the same user only:  
+# e(g,H(GID))^ω(i) of the rows cancel out if all of them are opened with one GID.
+# The stub: UpsilonWithHook is random and every row carries it, s = v[0] is shared by I4,
+# I2 = (g^s, )
+        if self._ap.compiled:
+            UpsilonWithHook = self.PPpow('e(gg)', v[0])
+            o = self._ap.randVector(zero = True)
+            r = [self.group.random(ZR) for i in range(self._ap.l)]
+            R = [(self._ATTI[self._ap.p(i)], self._ap.lmbda(i,v), self._ap.lmbda(i,o), r[i]) for i in range(self._ap.l)]
+            I2 = tuple(self.PPpow('g', ri) for ri in r)
+            s = None
+        else:
+            UpsilonWithHook = self.group.random(GT)
+            s = v[0]
+            R = [(self._ap.p(i), self._ap.lmbda(i,v)) for i in range(len(self._ATT))]
+            I2 = (self.PPpow('g', s), )
+
+        if self._pool is None or len(R) < self._rows_min:
+            CR = _encrypt_rows(self, R, s, rho1, b*rho1, self._ap.compiled)
+        else:
+            CR = self.__encrypt_rows_pool(R, s, rho1, b*rho1)
+
+        if self._ap.compiled:
+            I  = tuple(CRi[0] for CRi in CR)
+        else:
+            I  = tuple(UpsilonWithHook * CRi[0] for CRi in CR)
+        I4 = tuple(CRi[1] for CRi in CR)
+        E2 = tuple(CRi[2] for CRi in CR)
+        
+        E1 = self.PPpow('e(gf)', rho1)
+
+        return { 'UpsilonWithHook': UpsilonWithHook, 'rho1': rho1, 'AP': self._ap.policy,
+                 'I': I, 'I0': I0, 'I1': I1, 'I2': I2, 'I3': I3, 'I4': I4, 'E1': E1, 'E2': E2 }
+
+# ................................................................................
+#  Encryption executor
+#  The rows of the access policy are independent, so EncryptionCouponGen may split them 
+#  into chunks that a pool of worker processes evaluates with the authority keys loaded
+#  at startup. Policies with less than rows_min rows are encrypted in the main process:
+#  a row is four exponentiations and the round trip to the pool costs more than that.
+#  The executor is restarted when the authority keys change (AuthoritySetup, 
+#  AuthorityAddAttributes). The keys shall be saved before the executor is started.
+# ................................................................................
+    def StartExecutor(self, processes, rows_min = 64):
+        self.StopExecutor()
+        if processes is None or processes < 2:
+            return False
+        self._pool = ProcessPoolExecutor(processes, initializer = _encrypt_init, 
+                                         initargs = (self._msk_path, self._max_kw, self._id))
+        self._processes = processes
+        self._rows_min = rows_min
+        return True
+
+    def StopExecutor(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __restart_executor(self):
+        if self._pool is not None:
+            self.StartExecutor(self._processes, self._rows_min)
+
+# R - see _encrypt_rows; s, rho1, b*rho1 and r(i) are passed to workers as integers  
+    def __encrypt_rows_pool(self, R, s, rho1, brho1):
+        compiled = self._ap.compiled
+        if compiled:
+            R = [(row, lm, om, int(ri)) for (row, lm, om, ri) in R]
+        n = (len(R) + self._processes * 2 - 1) // (self._processes * 2)
+        E = (None if s is None else int(s), int(rho1), int(brho1), compiled)
+        CR = []
+        for b in self._pool.map(_encrypt_chunk, [(R[i:i + n], ) + E for i in range(0, len(R), n)]):
+            l = DES(b, self.group, False)
+            while not l.eof():
+                CR.append(l.g_val(3))
+        return CR
+
+# ................................................................................
+#  Encryption coupon pool
+#  A bounded pool of precomputed coupons. EncryptAndIndexGen takes coupons from 
+#  the pool while it is not empty.  CouponsSave/CouponsLoad keep the pool at 
+#  authority-N.ecp between runs. The file holds AES keys of future ciphertexts, so
+#  it shall be protected like ASK. CouponsLoad deletes the file, so a coupon cannot 
+#  be used twice even if the process is terminated before CouponsSave.
+#  The file ends with the access policy of the coupons (nothing for the default one),
+#  CouponsLoad drops the coupons of another policy.
+# ................................................................................
+    def CouponsFill(self, n = None):
+        if n is None:
+            n = self._ec_max
+        n = min(n, self._ec_max - len(self._EC))
+        for i in range(n):
+            self._EC.append(self.EncryptionCouponGen())
+        return n
+
+    @property
+    def coupons(self):
+        return len(self._EC)
+
+    def CouponsSave(self):
+        l = SER(self._ecp_fname, self.group, binary = self._binary)
+        l.p_size(len(self._EC))
+        for EC in self._EC:
+            l.p_val((EC['UpsilonWithHook'], EC['rho1'])).p_tup(EC['I']).p_val((EC['I0'], EC['I1']))
+            l.p_tup(EC['I2']).p_val((EC['I3'], ))
+            l.p_tup(EC['I4']).p_val((EC['E1'], )).p_tup(EC['E2'])
+        if self._ap.compiled:
+            l.p_str(self._ap.policy)
+
+    def CouponsLoad(self):
+        if not self._ecp_fname.exists():
+            return 0
+        l = DES(self._ecp_fname, self.group)
+        os.remove(self._ecp_fname)
+        sz = l.g_size()
+        C = []
+        for i in range(sz):
+            EC = {}
+            (EC['UpsilonWithHook'], EC['rho1']) = l.g_val(2)
+            EC['I'] = l.g_tup()
+            (EC['I0'], EC['I1']) = l.g_val(2)
+            EC['I2'] = l.g_tup()
+            (EC['I3'], ) = l.g_val(1)
+            EC['I4'] = l.g_tup()
+            (EC['E1'], ) = l.g_val(1)
+            EC['E2'] = l.g_tup()
+            C.append(EC)
+        AP = None if l.eof() else l.g_str()
+        if AP != self._ap.policy:
+            return 0
+        for EC in C:
+            EC['AP'] = AP
+            if len(self._EC) < self._ec_max:
+                self._EC.append(EC)
+        return sz
 
 # ................................................................................
 # Encrypt  (M,(A,ρ),KW,PP,{APK(i,j)}) → CT.  
 # Given  file M, access policy(A,ρ), keyword set KW, PP and theset of attribute public 
 # keys APK(i,j) for  relevant  authorities, the Encrypt outputs  the  ciphertext CT,  
 # which  contains the encrypted secure index I and the encrypted file CM.
+# Online part: keyword hashing, Formule de Viete and AES.  The coupon (EncryptionCouponGen) 
+# is taken from the pool, or generated if the pool is empty.
 # ................................................................................
-    def EncryptAndIndexGen(self, M, KW):
+    def EncryptAndIndexGen(self, M, KW, EC = None):
+        if EC is None:
+            EC = self._EC.popleft() if len(self._EC) > 0 else self.EncryptionCouponGen()
 
-        UpsilonWithHook = self.group.random(GT)
-        kse = extract_key(UpsilonWithHook)
+        kse = extract_key(EC['UpsilonWithHook'])
 
         a   = SymmetricCryptoAbstraction(kse)
         CM = a.lsabe_encrypt(bytes(M, "utf-8"))
 
-        hkw = []
-        for kw in KW:
-            hkw.append(self.group.hash(kw, ZR))
-        
-        eta = formuleDeViete(hkw)
-
-# Formule de Viete assumes P(x)=0
-# We have P(x)=1, so eta[0] is adjusted
-        eta[0] = eta[0] + 1
+        eta = self.KeywordPoly(KW)
 
 # .....
 # Check that polynomial coefficients are correct
-#        for hkwi in hkw:
-#            print ('P(' + str(hkwi) + ') = ' + str(polyVal(eta, hkwi)) + ' ~~~~ expected 1')
-
-        rho1, b = self.group.random(ZR), self.group.random(ZR)
-
-        v = self._ap.randVector()
-        s = v[0]
-        g = self._PP['g']
-
-        I0 = g ** b
-        I1 = g ** (self._MSK['lambda']*b)
-        I2 = g ** s
-        I3 = g ** rho1  
-        I  = ()
-        I4 = ()
-        E2 = ()
-        for i in range(len(self._ATT)):
-            ASKpi = self._ASK[self._ap.p(i)]
-            APKpi = self._APK[self._ap.p(i)]
-            Ii = UpsilonWithHook * ( ( APKpi['e(gg)^alfa'] )**s ) 
-            I4i = ( g **(ASKpi['beta'] * self._ap.lmbda(i,v)) ) * ( g ** (rho1 * ASKpi['y'])) 
-#                                                                The article says:  ** -rho1          
-#                                                                but it is definetely a mistake 
-            E2i = (APKpi['e(gg)^alfa'])**(b*rho1)
+#        for kw in KW:
+#            print ('P(' + str(kw) + ') = ' + str(polyVal(eta, self.KeywordHash(kw))) + ' ~~~~ expected 1')
 
-            I  = I  + (Ii, )
-            I4 = I4 + (I4i, )
-            E2 = E2 + (E2i, )
-        
-        E1 = pair(self._PP['g'], self._PP['f']) ** rho1
-
-        I5 = ( )
-        for eta_j in eta:
-            I5 = I5 + ((rho1 ** (-1)) * eta_j,  )
+        rho1inv = EC['rho1'] ** (-1)
+        I5 = tuple(rho1inv * eta_j for eta_j in eta)
 
 #        print("Ciphertext: ")
 #        print((I, I0, I1, I2, I3, I4, I5, E1, E2, CM))
 
-        return (I, I0, I1, I2, I3, I4, I5, E1, E2, CM)
+        return ciphertext(EC['I'], EC['I0'], EC['I1'], EC['I2'], EC['I3'], EC['I4'], I5, EC['E1'], EC['E2'], CM, EC['AP'])
 
 # ................................................................................
 #  Ciphertext serializer and deserializer
+#  The layout does not depend on the access policy of the authority: I2 is a tuple 
+#  (see EncryptionCouponGen) and CM is followed by the access policy AP the ciphertext  
+#  was encrypted under (nothing for the default policy). 
+#  Ciphertexts of earlier versions have a single I2 value and no AP, see ctView.I2_tuple
 # ................................................................................
     def serialize__CT(self, CT, ct_fname, open=True):
-        (I, I0, I1, I2, I3, I4, I5, E1, E2, CM) = CT
+        (I, I0, I1, I2, I3, I4, I5, E1, E2, CM, AP) = CT
         (ctCT, ctIV) = CM
 
-        l = SER(ct_fname, self.group, open)
-        l.p_tup(I).p_val((I0, I1, I2, I3)).p_tup(I4).p_tup(I5).p_val((E1,)).p_tup(E2).p_bytes(ctCT).p_bytes(ctIV)
+        l = SER(ct_fname, self.group, open, binary = self._binary)
+        l.p_tup(I).p_val((I0, I1)).p_tup(I2)
+        l.p_val((I3, )).p_tup(I4).p_tup(I5).p_val((E1,)).p_tup(E2).p_b64(ctCT).p_b64(ctIV)
+        if AP is not None:
+            l.p_str(AP)
 
-    def deserialize__CT(self, ct_fname, open=True):
+# lazy - return ctView that records the positions of the fields only, every field is 
+#        decoded on first access  
+    def deserialize__CT(self, ct_fname, open=True, lazy=False):
         l = DES(ct_fname, self.group, open)
-        return ((l.g_tup(), ) + l.g_val(4) + (l.g_tup(), ) + (l.g_tup(), ) + l.g_val(1) + (l.g_tup(), ) + ((l.g_bytes(), ) + (l.g_bytes(), ) ,) )
+        if lazy:
+            return ctView(l)
+        I = l.g_tup()
+        (I0, I1) = l.g_val(2)
+        I2 = l.g_tup() if I2_tuple(l) else l.g_val(1)
+        (I3, ) = l.g_val(1)
+        I4 = l.g_tup()
+        I5 = l.g_tup()
+        (E1, ) = l.g_val(1)
+        E2 = l.g_tup()
+        CM = (l.g_b64(), l.g_b64())
+        return ciphertext(I, I0, I1, I2, I3, I4, I5, E1, E2, CM, None if l.eof() else l.g_str())
+
+# ................................................................................
+# AggregateGen(CT) → A.
+# Ciphertext aggregates used by Search (E1*ΠE2) and Transform (ΠI, ΠI4^w). 
+# They depend on the ciphertext only, so the server computes them once when 
+# the ciphertext is stored.  The number of factors is defined by the size of  
+# the trapdoor or transformation key, so the aggregates are kept as prefix 
+# products: A['Im'][N-1] = I[0]*...*I[N-1]
+# ................................................................................
+    def AggregateGen(self, CT):
+        (I, I0, I1, I2, I3, I4, I5, E1, E2, CM, AP) = CT
+
+        E1E2m = []
+        E1E2mi = E1
+        for i in range(len(E2)):
+            E1E2mi = E1E2mi * E2[i]
+            E1E2m.append(E1E2mi)
+
+        Im  = []
+        I4m = []
+        Imi  = self._1
+        I4mi = I4[0] ** 0
+        for i in range(len(I)):
+            Imi  = Imi * I[i]
+            I4mi = I4mi * (I4[i] ** self._ap.w(i))
+            Im.append(Imi)
+            I4m.append(I4mi)
+
+        return aggregates(tuple(E1E2m), tuple(Im), tuple(I4m))
+
+# ................................................................................
+# SearchValueGen(CT,T2) → X.
+# X = I0^T2 * I1 is the ciphertext side of the Search pairing. T2 = H(GID) is the 
+# same in every trapdoor of the user, so the server may keep X per ciphertext for
+# the users with heavy query load and pass it to SearchPrepared.
+# ................................................................................
+    def SearchValueGen(self, CT, T2):
+        return (CT[1] ** T2) * CT[2]
+
+# ................................................................................
+#  Ciphertext aggregates serializer and deserializer
+# ................................................................................
+    def serialize__CTA(self, A, cta_fname, open=True):
+        l = SER(cta_fname, self.group, open, binary = self._binary)
+        l.p_tup(A['E1E2m']).p_tup(A['Im']).p_tup(A['I4m'])
+
+    def deserialize__CTA(self, cta_fname, open=True):
+        l = DES(cta_fname, self.group, open)
+        return aggregates(l.g_tup(), l.g_tup(), l.g_tup())
+
+# ................................................................................
+# TrapdoorCouponGen({SKi},PP) → TC.
+# Offline part of Trapdoor: the random values u, rho2 and T1 = K1^u, T5 = e(g,f)^u 
+# do not depend on the query keywords. A coupon is bound to the secret key set it 
+# was made with and shall be used only once.
+# ................................................................................
+    def TrapdoorCouponGen(self, SK):
+        u, rho2 = self.group.random(ZR), self.group.random(ZR)
+
+        T1 = tuple(K1 ** u for (K1, K3, K4) in SK)
+
+        T5 = self.PPpow('e(gf)', u)
+
+        return { 'u': u, 'rho2': rho2, 'T1': T1, 'T5': T5 }
+
+# ................................................................................
+#  Trapdoor coupon pools, one per GID
+#  TrapdoorCouponsFill may run in background thread (e.g. started at login), 
+#  TrapdoorGen takes coupons from the pool of the user while it is not empty.  
+#  TrapdoorCouponsSave/TrapdoorCouponsLoad keep the pool in a file between runs; 
+#  TrapdoorCouponsLoad deletes the file, so a coupon cannot be used twice.
+# ................................................................................
+    def TrapdoorCouponsFill(self, SK, GID, n, background = False):
+        if background:
+            t = threading.Thread(target = self.TrapdoorCouponsFill, args = (SK, GID, n), daemon = True)
+            t.start()
+            return t
+        TC = self._TC.setdefault(GID, deque())
+        for i in range(n):
+            TC.append(self.TrapdoorCouponGen(SK))
+
+    def TrapdoorCoupons(self, GID):
+        return len(self._TC.get(GID, ()))
+
+    def TrapdoorCouponsSave(self, GID, tc_fname):
+        TC = self._TC.get(GID, ())
+        l = SER(tc_fname, self.group, binary = self._binary)
+        l.p_size(len(TC))
+        for TCi in TC:
+            l.p_val((TCi['u'], TCi['rho2'])).p_tup(TCi['T1']).p_val((TCi['T5'], ))
+
+    def TrapdoorCouponsLoad(self, GID, tc_fname):
+        if not tc_fname.exists():
+            return 0
+        l = DES(tc_fname, self.group)
+        os.remove(tc_fname)
+        TC = self._TC.setdefault(GID, deque())
+        sz = l.g_size()
+        for i in range(sz):
+            TCi = {}
+            (TCi['u'], TCi['rho2']) = l.g_val(2)
+            TCi['T1'] = l.g_tup()
+            (TCi['T5'], ) = l.g_val(1)
+            TC.append(TCi)
+        return sz
 
 # ................................................................................
 # Trapdoor ({SKi,GID},KW′,PP)→TKW′. 
 # Given the secret key set, query keyword set KW′ and PP, data users run Trapdoor, 
 # which outputs the keyword trapdoor TKW′.
+# Online part: keyword power sums.  The coupon (TrapdoorCouponGen) is taken from  
+# the pool of the user, or generated if the pool is empty.
+# degree - the number of T4 coefficients. Search never uses more coefficients than
+# the longest I5 in the corpus, so the trapdoor may be truncated to the degree 
+# advertised by the server. Defaults to max_kw + 1, i.e. to the longest possible I5. 
 # ................................................................................
 
-    def TrapdoorGen(self, SK, GID, KW):
-        u, rho2 = self.group.random(ZR), self.group.random(ZR)
-
-        T1 = ()
-        for sk in SK:
-            (K1, K3, K4) = sk
-            T1sk = K1 ** u
-            T1 = T1 + (T1sk, )
+    def TrapdoorGen(self, SK, GID, KW, TC = None, degree = None):
+        if TC is None:
+            pool = self._TC.get(GID)
+            TC = pool.popleft() if pool else self.TrapdoorCouponGen(SK)
+        u, rho2 = TC['u'], TC['rho2']
 
         T2 = self.group.hash(GID, ZR)
         lKW = self._1 * len(KW)                     # Make it ZR* value otherwise lkW**(-1) makes little sense 
         T3 = (u * rho2) * (lKW**(-1))
 
-        T4 = ( )
-        for j in range(0, self._max_kw):
-            T4j = 0
-            for kw in KW:
-                T4j = T4j + self.group.hash(kw, ZR) ** j
-            T4 = T4 + ((rho2 ** (-1)) * T4j ,)
-
-        T5 = pair(self._PP['g'], self._PP['f']) ** u
+        if degree is None:
+            degree = self._max_kw + 1
+        r = self.group.order()
+        rho2inv = int(rho2 ** (-1))
+        S = powerSums([self.KeywordHash(kw) for kw in KW], degree, r)
+        T4 = tuple(self.group.init(ZR, (rho2inv * Sj) % r) for Sj in S)
 
 #        print ("Trapdoor:")
-#        print ((T1, T2, T3, T4, T5))
+#        print ((TC['T1'], T2, T3, T4, TC['T5']))
 
-        return (T1, T2, T3, T4, T5)
+        return trapdoor(TC['T1'], T2, T3, T4, TC['T5'])
 
 # ................................................................................
 #  Trapdoor serializer and deserializer
@@ -341,12 +852,81 @@ class LSABE_AUTH(LSABE_MA):
     def serialize__TD(self, TD, td_fname, open = True):
         (T1, T2, T3, T4, T5) = TD
 
-        l = SER(td_fname, self.group, open)
+        l = SER(td_fname, self.group, open, binary = self._binary)
         l.p_tup(T1).p_val((T2, T3)).p_tup(T4).p_val((T5,))
 
     def deserialize__TD(self, td_fname, open = True):
         l = DES(td_fname, self.group, open)
-        return ((l.g_tup(), ) + l.g_val(2) + (l.g_tup(), ) + l.g_val(1))
+        T1 = l.g_tup()
+        (T2, T3) = l.g_val(2)
+        return trapdoor(T1, T2, T3, l.g_tup(), l.g_val(1)[0])
+
+# ................................................................................
+# PrepareQuery(TKW′,TKGID) → Q.
+# Trapdoor and transformation key aggregates used by Search and Transform. They do not
+# depend on the ciphertext, so the server prepares the query once and applies it to 
+# every stored ciphertext.  Either TD or TK may be None if only Search or only 
+# Transform is going to be executed.
+#
+# The query also carries the fixed pairing arguments. Charm does not expose PBC 
+# pairing preprocessing (pairing_pp_init), so the fixed side is prepared by 
+# bilinearity instead: 
+#   e(I0^T2 * I1, T1m) = e(I0, T1m^T2) * e(I1, T1m)
+# moves the per-ciphertext exponentiation I0^T2 to the one-off T1m^T2 and leaves
+# a two-element pairing product with shared final exponentiation, and
+#   e(I4m, TK2)^-1 = e(I4m, TK2^-1)
+# replaces the per-ciphertext GT division.
+# Pairings take ciphertext element (G1) first and key element (G2 for asymmetric 
+# curves) second.
+# ................................................................................
+#
+# Compiled access policy: attrs are the user attributes in the order of SK entries 
+# (KeyAttributes). The query keeps the minimal satisfying row subset of A with 
+# reconstruction coefficients w as (row, SK entry, w) and only these rows are used by 
+# Search and Transform. Q['rows'] is None if attrs do not satisfy the policy.
+# ................................................................................
+    def PrepareQuery(self, TD, TK, attrs = None):
+        Q = {'TD': TD, 'TK': TK}
+
+        if self._ap.compiled:
+            pos = {}
+            for j in range(len(attrs or ())):
+                pos.setdefault(attrs[j], j)
+            C = self._ap.coefficients(frozenset(pos))
+            Q['rows'] = None if C is None else tuple((i, pos[self._ap.p(i)], w) for (i, w) in C)
+            if Q['rows'] is None:
+                return Q
+
+        if TD is not None:
+            (T1, T2, T3, T4, T5) = TD
+            if self._ap.compiled:
+                T1m = T1[Q['rows'][0][1]]
+                for (i, j, w) in Q['rows'][1:]:
+                    T1m = T1m * T1[j]
+            else:
+                T1m = T1[self._ap.p(0)]
+                for i in range(1, len(T1)):
+                    T1m = T1m * T1[self._ap.p(i)]
+            Q['T1m'] = T1m
+            Q['T1m^T2'] = T1m ** T2
+
+        if TK is not None:
+            (TK2, TK3, TK4) = TK
+            N = len(TK4)
+            if self._ap.compiled:
+                TK3m = multiExp(self.group, [TK3[j] for (i, j, w) in Q['rows']], [w for (i, j, w) in Q['rows']])
+# Every row has its own I2(i), so TK4 is not aggregated: TK4(j)^w(i) pairs with I2(i)
+                Q['TK4w'] = tuple(TK4[j] ** w for (i, j, w) in Q['rows'])
+            else:
+                TK3m = multiExp(self.group, [TK3[self._ap.p(i)] for i in range(N)], [self._ap.w(i) for i in range(N)])
+                TK4m = TK4[self._ap.p(0)]
+                for i in range (1, N):
+                    TK4m = TK4m * TK4[self._ap.p(i)]
+                Q['TK4m'] = TK4m
+            Q['TK3m'] = TK3m
+            Q['TK2^-1'] = TK2 ** -1
+
+        return Q
 
 # ................................................................................
 # Search(CT,TKW′) → 0/1.  
@@ -355,21 +935,51 @@ class LSABE_AUTH(LSABE_MA):
 # If theoutput is “1”, the query is successful and the cloud servers continue 
 # to run the transform algorithm.
 # ................................................................................
-    def Search(self, CT, TKW):
-        (I, I0, I1, I2, I3, I4, I5, E1, E2, CM) = CT
-        (T1, T2, T3, T4, T5) = TKW
-
-        T1m = T1[self._ap.p(0)]
-        E2m = E2[0]
-        for i in range(1, len(T1)):
-            T1m = T1m * T1[self._ap.p(i)]
-            E2m = E2m * E2[i]
-
-        T4m = I5[0]*T4[0]
-        for j in range(1, len(I5)):
-            T4m = T4m + I5[j]*T4[j]
-
-        return (T5 * pair(T1m, (I0 ** T2) * I1) == (E1 * E2m) ** (T3 * T4m))
+    def Search(self, CT, TKW, attrs = None):
+        return self.SearchPrepared(CT, self.PrepareQuery(TKW, None, attrs))
+
+# A - ciphertext aggregates (AggregateGen), computed on the fly if not provided
+# X - I0^T2 * I1 (SearchValueGen) for T2 of the trapdoor, if materialized by the server
+# T4m - Σ I5[j]*T4[j] (integer), if computed for the whole corpus (keywordMatrix)
+# CT may be a lazy ciphertext (ctView) that decodes a field on first access, so every field
+# is read by the branch that uses it only: I5 is not decoded if T4m is provided, I0 and I1 
+# are not decoded if X is provided, E1 and E2 are not decoded if aggregates are used
+# A ciphertext of another access policy (see serialize__CT) does not match
+    def SearchPrepared(self, CT, Q, A = None, X = None, T4m = None):
+        if CT[10] != self._ap.policy:
+            return False
+        (T1, T2, T3, T4, T5) = Q['TD']
+
+# Compiled access policy: the rows of the query, aggregates are not used
+        if self._ap.compiled:
+            if Q['rows'] is None:
+                return False
+            E2 = CT[8]
+            E1E2m = CT[7]
+            for (i, j, w) in Q['rows']:
+                E1E2m = E1E2m * E2[i]
+        elif A is None:
+            E2 = CT[8]
+            E1E2m = CT[7] * E2[0]
+            for i in range(1, len(T1)):
+                E1E2m = E1E2m * E2[i]
+        else:
+            E1E2m = A['E1E2m'][len(T1) - 1]
+
+        if T4m is None:
+            I5 = CT[6]
+            T4m = I5[0]*T4[0]
+            for j in range(1, len(I5)):
+                T4m = T4m + I5[j]*T4[j]
+        else:
+            T4m = self.group.init(ZR, T4m)
+
+        if X is None:
+            eT1mX = self.PairProd((CT[1], CT[2]), (Q['T1m^T2'], Q['T1m']))
+        else:
+            eT1mX = pair(X, Q['T1m'])
+
+        return (T5 * eT1mX == E1E2m ** (T3 * T4m))
 
 # ................................................................................
 # Transform (CT,TKGID) → CTout/⊥.  
@@ -377,47 +987,61 @@ class LSABE_AUTH(LSABE_MA):
 # into a transformed ciphertext and then returns the transformed ciphertext CTout 
 # to the user end. Otherwise, itoutputs ⊥.
 # ................................................................................
-    def Transform(self, CT, TK):
-        (I, I0, I1, I2, I3, I4, I5, E1, E2, CM)   = CT
-        (TK2, TK3, TK4) = TK
+    def Transform(self, CT, TK, attrs = None):
+        return self.TransformPrepared(CT, self.PrepareQuery(None, TK, attrs))
+
+# A - ciphertext aggregates (AggregateGen), computed on the fly if not provided
+# I and I4 are not needed if aggregates are provided (ctView does not decode them then)
+# A ciphertext of another access policy is not transformed (None)
+    def TransformPrepared(self, CT, Q, A = None):
+        if CT[10] != self._ap.policy:
+            return None
+        (I3, CM) = (CT[4], CT[9])
+        (TK2, TK3, TK4) = Q['TK']
 
         N = len(TK4)
 
-        TK3m  = self._1
-        TK4m  = self._1
-        I4m   = self._1
-        Im    = self._1
-
-        for i in range (N):
-            I4m  = I4m * (I4[i] ** self._ap.w(i))
-            TK3m = TK3m * (TK3[self._ap.p(i)] ** self._ap.w(i))
-            TK4m = TK4m * TK4[self._ap.p(i)]
-            Im   = Im * I[i]
-
-        TI = pair(TK4m, I2) / pair(I4m, TK2) * pair(I3, TK3m)
+# Compiled access policy: ΠI^w recovers UpsilonWithHook itself, so N = 1.
+# Only the rows of the query are exponentiated, aggregates are not used.
+#   TI = Π e(I2(i), TK4(j)^w(i)) * e(ΠI4^w, TK2^-1) * e(I3, TK3m) = e(g,g)^(z*Σw(i)*alfa*r(i))
+# since Σw(i)*ω(i) = 0, and ΠI^w = UpsilonWithHook * e(g,g)^Σw(i)*alfa*r(i)
+        if self._ap.compiled:
+            if Q['rows'] is None:
+                return None
+            (I, I2, I4) = (CT[0], CT[3], CT[5])
+            I4m = multiExp(self.group, [I4[i] for (i, j, w) in Q['rows']], [w for (i, j, w) in Q['rows']])
+            Im  = multiExp(self.group, [I[i] for (i, j, w) in Q['rows']], [w for (i, j, w) in Q['rows']])
+            TI  = self.PairProd(tuple(I2[i] for (i, j, w) in Q['rows']) + (I4m, I3), Q['TK4w'] + (Q['TK2^-1'], Q['TK3m']))
+            return ctOut(CM, TI, Im, 1)
+        elif A is None:
+            (I, I4) = (CT[0], CT[5])
+            I4m   = multiExp(self.group, I4[:N], [self._ap.w(i) for i in range(N)])
+            Im    = I[0]
+            for i in range (1, N):
+                Im   = Im * I[i]
+        else:
+            I4m = A['I4m'][N - 1]
+            Im  = A['Im'][N - 1]
+
+        TI = self.PairProd((CT[3][0], I4m, I3), (Q['TK4m'], Q['TK2^-1'], Q['TK3m']))
         TTI = Im
 
-        return (CM,TI,TTI,N)    
+        return ctOut(CM,TI,TTI,N)    
 
 
 # ................................................................................
 #  Partially decrypted ciphertext serializer and deserializer
 # ................................................................................
-    def serialize__CTout(self, CTout, ct_fname, open = True):
+# binary - format of this CTout (e.g. negotiated with the client), the default is LSABE_MA.binary
+    def serialize__CTout(self, CTout, ct_fname, open = True, binary = None):
         (CM, TI, TTI, N) = CTout
         (ctCT, ctIV) = CM
 
-        l = SER(ct_fname, self.group, open)
-        l.p_val((TI, TTI)).p_bytes(ctCT).p_bytes(ctIV).p_int(N)
+        l = SER(ct_fname, self.group, open, binary = self._binary if binary is None else binary)
+        l.p_val((TI, TTI)).p_b64(ctCT).p_b64(ctIV).p_int(N)
 
     def deserialize__CTout(self, ct_fname, open = True):
-        l = DES(ct_fname, self.group, open)
-        (TI, TTI) = l.g_val(2)
-        ctCT = l.g_bytes()
-        ctIV = l.g_bytes()
-        N = l.g_int()
-        CM = (ctCT, ctIV)
-        return (CM, TI, TTI, N)
+        return _deserialize__CTout(self.group, ct_fname, open)
 
 
 # ................................................................................
@@ -437,3 +1061,166 @@ class LSABE_AUTH(LSABE_MA):
         M   = a.lsabe_decrypt(CM)
 
         return M
+
+# ................................................................................
+#  DecryptMany(z,{CTout}) → {M}
+#  Batch decryption of search results. 1/z is computed once and 1/N once per distinct N;
+#  Υ = TTI^(1/N) * TI^(-1/(zN)) is a single multi-exponentiation.
+#  CTouts are CTout records (tuples) or serialized CTouts (str, bytes or other byte buffers, as they 
+#  are returned by the server).
+#  M is None for a CTout that cannot be decrypted. 
+#  DecryptIter decrypts CTouts one by one as they arrive from any iterable (e.g. streamed
+#  server response). DecryptMany spreads result sets of pool_min or more CTouts across 
+#  a pool of worker processes if processes is set
+# ................................................................................
+    def DecryptIter(self, z, CTouts):
+        zinv = int(self._1/z)
+        NI = {}
+        for CTout in CTouts:
+            yield _decrypt(self.group, zinv, NI, CTout)
+
+    def DecryptMany(self, z, CTouts, processes = None, pool_min = 32):
+        CTouts = list(CTouts)
+        if processes is None or processes < 2 or len(CTouts) < pool_min:
+            return list(self.DecryptIter(z, CTouts))
+
+        B = []
+        for CTout in CTouts:
+            if isinstance(CTout, (tuple, ctOut)):
+                cts = io.BytesIO()
+                self.serialize__CTout(CTout, cts, False)
+                CTout = cts.getvalue()
+# Buffers (memoryview, mmap) cannot be passed to worker processes
+            elif not isinstance(CTout, (str, bytes)):
+                CTout = bytes(CTout)
+            B.append(CTout)
+
+        n = (len(B) + processes * 4 - 1) // (processes * 4)
+        with ProcessPoolExecutor(processes, initializer = _decrypt_init, initargs = (self._curve, int(self._1/z))) as pool:
+            R = pool.map(_decrypt_chunk, [B[i:i + n] for i in range(0, len(B), n)])
+        return [M for chunk in R for M in chunk]
+
+
+# ................................................................................
+#  Module level helpers of CTout deserialization and decryption, shared with
+#  DecryptMany worker processes (charm elements cannot be pickled, so workers receive
+#  curve name, 1/z as integer and serialized CTouts)
+# ................................................................................
+def _deserialize__CTout(group, ct_fname, open = True):
+    l = DES(ct_fname, group, open)
+    (TI, TTI) = l.g_val(2)
+    ctCT = l.g_b64()
+    ctIV = l.g_b64()
+    N = l.g_int()
+    CM = (ctCT, ctIV)
+    return ctOut(CM, TI, TTI, N)
+
+# NI - cache of 1/N
+# None is returned for damaged or truncated serialized CTout and for the message that
+# does not decrypt (wrong key: bad padding, not UTF-8). Other errors (e.g. elements of 
+# other curve) are raised
+def _decrypt(group, zinv, NI, CTout):
+    if not isinstance(CTout, (tuple, ctOut)):
+        try:
+            CTout = _deserialize__CTout(group, bytes(CTout, 'utf-8') if isinstance(CTout, str) else CTout, False)
+        except (ValueError, IndexError):
+            return None
+    (CM,TI,TTI,N) = CTout
+
+    r = group.order()
+    ninv = NI.get(N)
+    if ninv is None:
+        ninv = NI[N] = pow(int(N), -1, r)
+    UpsilonWithHook = multiExp(group, (TTI, TI), (ninv, -zinv * ninv))
+    kse = extract_key(UpsilonWithHook)
+    a   = SymmetricCryptoAbstraction(kse)
+    try:
+        return a.lsabe_decrypt(CM)
+    except ValueError:
+        return None
+
+_worker = {}
+
+def _decrypt_init(curve, zinv):
+    _worker['group'] = PairingGroup(curve)
+    _worker['zinv'] = zinv
+    _worker['NI'] = {}
+
+def _decrypt_chunk(B):
+    return [_decrypt(_worker['group'], _worker['zinv'], _worker['NI'], CTout) for CTout in B]
+
+# Bulk key generation worker
+def _keygen_init(msk_path, max_kw, id, binary):
+    _worker['auth'] = LSABE_AUTH(msk_path, max_kw, id, binary = binary)
+    _worker['auth'].AuthorityLoad()
+
+def _keygen_chunk(users):
+    auth = _worker['auth']
+    return auth.serialize__KS(users, auth.SecretKeyGenMany(users))
+
+# ................................................................................
+#  Encryption helpers, shared with encryption executor worker processes
+#  R - (row, λ(row)) of the stub policy, (row, λ(row), ω(row), r(row)) of a compiled 
+#  policy (see EncryptionCouponGen). Returns (Ii, I4i, E2i) for each row, where Ii of  
+#  the stub policy lacks the factor UpsilonWithHook (it is the same for all rows and 
+#  stays in the main process)
+# ................................................................................
+def _encrypt_rows(auth, R, s, rho1, brho1, compiled):
+    CR = []
+    for Ri in R:
+        row = Ri[0]
+        ASKpi = auth._ASK[row]
+        if compiled:
+            (lm, om, ri) = Ri[1:]
+            Ii = auth.PPpow('e(gg)', lm) * auth.APKpow(row, ri)
+            I4i = auth.PPpow('g', ASKpi['beta'] * ri + rho1 * ASKpi['y'] + om)
+        else:
+            lm = Ri[1]
+            Ii = auth.APKpow(row, s)
+# g^(beta*lmbda) * g^(rho1*y) is evaluated as single fixed-base exponentiation g^(beta*lmbda + rho1*y)
+            I4i = auth.PPpow('g', ASKpi['beta'] * lm + rho1 * ASKpi['y'])
+#                                                                The article says:  ** -rho1          
+#                                                                but it is definetely a mistake 
+        E2i = auth.APKpow(row, brho1)
+        CR.append((Ii, I4i, E2i))
+    return CR
+
+def _encrypt_init(msk_path, max_kw, id):
+    _worker['auth'] = LSABE_AUTH(msk_path, max_kw, id)
+    _worker['auth'].AuthorityLoad()
+
+def _encrypt_chunk(E):
+    auth = _worker['auth']
+    (R, s, rho1, brho1, compiled) = E
+    if compiled:
+        R = [(row, lm, om, auth.group.init(ZR, ri)) for (row, lm, om, ri) in R]
+    else:
+        s = auth.group.init(ZR, s)
+    (rho1, brho1) = (auth.group.init(ZR, rho1), auth.group.init(ZR, brho1))
+    b = io.BytesIO()
+    l = SER(b, auth.group, False, binary = True)
+    for CRi in _encrypt_rows(auth, R, s, rho1, brho1, compiled):
+        l.p_val(CRi)
+    return b.getvalue()
+
+# ................................................................................
+#  Authority setup helpers, shared with AuthoritySetup worker processes
+#  K - (alfa, y, beta) of new attributes, beta as integer
+# ................................................................................
+def _attribute_keys(ma, K):
+    R = []
+    for (alfa, y, beta) in K:
+        R.append({ 'e(gg)^alfa' : ma.PPpow('e(gg)', alfa), 'g**y': ma.PPpow('g', y), 'g**beta': ma.PPpow('g', beta) })
+    return R
+
+def _setup_init(msk_path, max_kw):
+    _worker['ma'] = LSABE_MA(msk_path, max_kw)
+    _worker['ma'].GlobalLoad()
+
+def _setup_chunk(K):
+    ma = _worker['ma']
+    b = io.BytesIO()
+    l = SER(b, ma.group, False, binary = True)
+    for APKi in _attribute_keys(ma, K):
+        l.p_val(APKi.values())
+    return b.getvalue()
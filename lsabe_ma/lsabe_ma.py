@@ -2,6 +2,7 @@ import os
 import sys
 import random
 from pathlib import Path
+from functools import lru_cache
 
 from base64 import b64encode, b64decode
 
@@ -11,26 +12,66 @@ from charm.toolbox.pairinggroup import PairingGroup,ZR,G1,G2,GT,pair,extract_key
 from .symcrypto import SymmetricCryptoAbstraction
 from .serializer import SER, DES
 from .accessPolicy import accessPolicy
+from .fixedBase import fixedBase
+from .formuleDeViete import formuleDeViete, polyFromRoots
 
 
+# Supported pairing curves (charm-crypto parameter sets). SS curves are symmetric 
+# (Type-1), the others are asymmetric: ciphertext elements are placed in G1, key 
+# elements (K1, K3, K4, TK, T1) and H(GID) in G2, and every pairing is e(G1, G2). 
+CURVES = ('SS512', 'SS1024', 'MNT159', 'MNT201', 'MNT224', 'BN254')
+
 class LSABE_MA():
-    def __init__(self, msk_path, max_kw):
+# kw_cache   - capacity of keyword hash cache
+# poly_cache - capacity of keyword polynomial cache
+# curve      - pairing curve for GlobalSetup; GlobalLoad takes the curve recorded in PP
+# binary     - write keys, ciphertexts, trapdoors, etc. in binary format (see serializer.py);
+#              both formats are read regardless of this flag
+    def __init__(self, msk_path, max_kw, kw_cache = 4096, poly_cache = 1024, curve = 'SS512', binary = True):
 
 # These are file names to load\store MSK and PP
         self._msk_fname = msk_path.joinpath('lsabe-ma.msk')   
         self._pp_fname  = msk_path.joinpath('lsabe-ma.pp')
+# Fixed-base exponentiation tables for PP generators
+        self._ppt_fname = msk_path.joinpath('lsabe-ma.ppt')
 # The maximum number of keywords
+# It is a system parameter: GlobalSetup stores it in PP, GlobalLoad restores it from PP
         self._max_kw = max_kw   
+        self._binary = binary
+       
+# Access policy
+        self._ap = accessPolicy()       
+
+# Keyword hash H(kw) and keyword polynomial memo, LRU
+        self.KeywordHash = lru_cache(maxsize = kw_cache)(self.__keyword_hash)
+        self.__keyword_poly_lru = lru_cache(maxsize = poly_cache)(self.__keyword_poly)
+
+        self.__set_curve(curve)
+
 # ....
 # [charm crypto] For symmetric pairing G1 == G2  
-        self.group = PairingGroup('SS512')
+    def __set_curve(self, curve):
+        if curve not in CURVES:
+            raise ValueError('Unsupported pairing curve ' + str(curve))
+        self._curve = curve
+        self.group = PairingGroup(self._curve)
+        self.__pair_prod = hasattr(self.group, 'pair_prod')
+# The group the key elements belong to
+        self._GK = G1 if self.symmetric else G2
 
 # 1 in ZR (a kind of ugly but I cannot think of better method)
         x = self.group.random(ZR) 
         self._1 = x/x       
-       
-# Access policy
-        self._ap = accessPolicy()       
+
+        self.KeywordCacheClear()
+
+    @property
+    def curve(self):
+        return self._curve
+
+    @property
+    def symmetric(self):
+        return self._curve.startswith('SS')
 
     @property
     def msk_fname(self):
@@ -40,6 +81,18 @@ class LSABE_MA():
     def pp_fname(self):
         return str(self._pp_fname)
 
+    @property
+    def ppt_fname(self):
+        return str(self._ppt_fname)
+
+    @property
+    def max_kw(self):
+        return self._max_kw
+
+    @property
+    def binary(self):
+        return self._binary
+
    
 
 # ................................................................................
@@ -52,9 +105,13 @@ class LSABE_MA():
     def GlobalSetup(self):
         f = self.group.random(G1) 
         g = self.group.random(G1)
+# Asymmetric curves: g2 generates G2 (key side), e(g,g) stands for e(g,g2)
+        g2 = g if self.symmetric else self.group.random(G2)
         lmbda = self.group.random(ZR)
         self._MSK = { 'lambda':lmbda }        
-        self._PP =  { 'f':f, 'g':g, 'g^lambda':g ** lmbda }
+        self._PP =  { 'f':f, 'g':g, 'g2':g2, 'e(gf)':pair(f, g2), 'e(gg)':pair(g, g2) }
+        self.__build_T()
+        self._PP['g^lambda'] = self.PPpow('g', lmbda)
 
 #        print("Master secret key:")
 #        print(self._MSK)
@@ -62,6 +119,7 @@ class LSABE_MA():
 #        print(self._PP)
 
         self.__serialize_G()
+        self.__serialize_T()
 
 
 # ................................................................................
@@ -70,30 +128,157 @@ class LSABE_MA():
 # ................................................................................
     def GlobalLoad(self):
         self.__deserialize_G()
+        self.__load_T()
 
 #        print("Master secret key:")
 #        print(self._MSK)
 #        print("Public properties:")
 #        print(self._PP)
 
+# ................................................................................
+#  PPpow
+#  Exponentiation of PP base ('g', 'g2', 'e(gf)' or 'e(gg)') through its fixed-base table
+# ................................................................................
+    def PPpow(self, k, e):
+        return self._PPT[k].pow(e)
+
+# ................................................................................
+#  KeywordHash(kw) → H(kw) ∈ ZR  (LRU cache, see __init__)
+#  KeywordPoly(KW) → coefficients of P(x) such that P(H(kw)) = 1 for every kw in KW
+#  The polynomial does not depend on the order of keywords, so the memo is keyed 
+#  by sorted keyword set. 
+#  Large keyword sets go through the product tree (polyFromRoots) over integers, 
+#  Formule de Viete is quadratic and is used for short sets only
+# ................................................................................
+    _VIETE_MAX = 64
+
+    def __keyword_hash(self, kw):
+        return self.group.hash(kw, ZR)
+
+    def __keyword_poly(self, KW):
+        if len(KW) > self._VIETE_MAX:
+            r = self.group.order()
+            eta = [self.group.init(ZR, c) for c in polyFromRoots([self.KeywordHash(kw) for kw in KW], r)]
+        else:
+            eta = formuleDeViete([self.KeywordHash(kw) for kw in KW])
+# Formule de Viete assumes P(x)=0
+# We have P(x)=1, so eta[0] is adjusted
+        eta[0] = eta[0] + 1
+        return tuple(eta)
+
+    def KeywordPoly(self, KW):
+        return self.__keyword_poly_lru(tuple(sorted(KW)))
+
+# Hit/miss counters of keyword hash cache and keyword polynomial memo
+    def KeywordCacheInfo(self):
+        return { 'hash': self.KeywordHash.cache_info(), 'poly': self.__keyword_poly_lru.cache_info() }
+
+    def KeywordCacheClear(self):
+        self.KeywordHash.cache_clear()
+        self.__keyword_poly_lru.cache_clear()
+
+# ................................................................................
+#  PairProd
+#  Product of pairings e(A[0],B[0]) * e(A[1],B[1]) * ...  
+#  PBC evaluates it with a shared Miller loop and a single final exponentiation.
+#  Charm builds without PairingGroup.pair_prod fall back to separate pairings
+# ................................................................................
+    def PairProd(self, A, B):
+        if self.__pair_prod:
+            return self.group.pair_prod(A, B)
+        R = pair(A[0], B[0])
+        for i in range(1, len(A)):
+            R = R * pair(A[i], B[i])
+        return R
+
 # ................................................................................
 #  Serializer and deserializer
 # ................................................................................
     def __serialize_G(self):
-        l = SER(self._msk_fname, self.group)
+        l = SER(self._msk_fname, self.group, binary = self._binary)
         l.p_val(self._MSK.values())
 
-        l = SER(self._pp_fname, self.group)
-        l.p_val(self._PP.values())
+        l = SER(self._pp_fname, self.group, binary = self._binary)
+        l.p_str(self._curve)
+        l.p_val((self._PP['f'], self._PP['g'], self._PP['g^lambda'], self._PP['e(gf)'], self._PP['e(gg)']))
+        l.p_size(self._max_kw)
+        if not self.symmetric:
+            l.p_val((self._PP['g2'], ))
 
     def __deserialize_G(self):
+# PP files created before the curve was recorded start with a group element (SS512)
+        l = DES(self._pp_fname, self.group)
+        recorded = l.binary or ':' not in l.peek()
+        curve = l.g_str() if recorded else 'SS512'
+        if curve != self._curve:
+            self.__set_curve(curve)
+            l = DES(self._pp_fname, self.group)
+            if recorded:
+                l.g_str()
+
+        self._PP = {}
+        (self._PP['f'], self._PP['g'], self._PP['g^lambda'], ) = l.g_val(3)
+        self._PP['g2'] = self._PP['g']
+# PP files created before e(g,f) and e(g,g) were cached hold three values only
+        if l.eof():
+            self._PP['e(gf)'] = pair(self._PP['f'], self._PP['g2'])
+            self._PP['e(gg)'] = pair(self._PP['g'], self._PP['g2'])
+        else:
+            (self._PP['e(gf)'], self._PP['e(gg)'], ) = l.g_val(2)
+# PP files created before the maximum number of keywords was persisted keep the value
+# passed to the constructor
+            if not l.eof():
+                self._max_kw = l.g_size()
+            if not self.symmetric:
+                (self._PP['g2'], ) = l.g_val(1)
+
         l = DES(self._msk_fname, self.group)
         self._MSK = {}
         (self._MSK['lambda'], ) = l.g_val(1)
 
-        l = DES(self._pp_fname, self.group)
-        self._PP = {}
-        (self._PP['f'], self._PP['g'], self._PP['g^lambda'], ) = l.g_val(3)
+# ................................................................................
+#  Fixed-base tables serializer and deserializer
+#  Tables are built once and cached at lsabe-ma.ppt. The cache is rebuilt if it is
+#  missing, damaged or was built for other PP (e.g. after GlobalSetup at another host).
+#  f is never raised to a power (it only enters e(g,f)), so it has no table
+# ................................................................................
+    __PPT_KEYS = ('g', 'e(gf)', 'e(gg)')
+
+# Symmetric curves: g2 == g, so its table is shared
+    def __ppt_keys(self):
+        return self.__PPT_KEYS if self.symmetric else self.__PPT_KEYS + ('g2', )
+
+    def __build_T(self):
+        self._PPT = {}
+        for k in self.__ppt_keys():
+            self._PPT[k] = fixedBase(self.group, self._PP[k])
+        self._PPT.setdefault('g2', self._PPT['g'])
+
+    def __serialize_T(self):
+        l = SER(self._ppt_fname, self.group, binary = self._binary)
+        for k in self.__ppt_keys():
+            self._PPT[k].serialize(l)
+
+    def __deserialize_T(self):
+        l = DES(self._ppt_fname, self.group)
+        self._PPT = {}
+        for k in self.__ppt_keys():
+            self._PPT[k] = fixedBase.deserialize(self.group, l)
+        self._PPT.setdefault('g2', self._PPT['g'])
+
+    def __load_T(self):
+        try:
+            self.__deserialize_T()
+            if all(self._PPT[k].base == self._PP[k] for k in self.__ppt_keys()):
+                return
+        except:
+            pass
+
+        self.__build_T()
+        try:
+            self.__serialize_T()
+        except:
+            pass
 
 
 # ................................................................................
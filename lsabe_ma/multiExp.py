@@ -0,0 +1,52 @@
+# .... LSABE simultaneous multi-exponentiation ...
+# multiExp - B[0]^E[0] * B[1]^E[1] * ... * B[n-1]^E[n-1]
+#
+# Interleaved (Straus) windowed method: every base gets a small table b^1 .. b^(2^w-1)
+# and all exponents are scanned together from the most significant window, so the
+# squarings are shared by all bases.  Zero exponents are skipped, exponents equal to one
+# cost a single multiplication, and a single remaining exponent is left to native
+# exponentiation that is faster than any Python-level loop.
+# E holds either ZR elements or integers. B shall not be empty.
+
+def multiExp(group, B, E, window = 4):
+    r = group.order()
+    R = None
+    P = []
+
+    for i in range(len(B)):
+        e = E[i] if isinstance(E[i], int) else int(E[i])
+        e = e % r
+        if e == 0:
+            continue
+        if e == 1:
+            R = B[i] if R is None else R * B[i]
+            continue
+        P.append((B[i], e))
+
+    if len(P) == 1:
+        (b, e) = P[0]
+        R = b ** e if R is None else R * (b ** e)
+    elif len(P) > 1:
+        mask = (1 << window) - 1
+        T = []
+        for (b, e) in P:
+            t = [b]
+            for d in range(1, mask):
+                t.append(t[d - 1] * b)
+            T.append(t)
+
+        nwin = (max(e.bit_length() for (b, e) in P) + window - 1) // window
+        acc = None
+        for k in range(nwin - 1, -1, -1):
+            if acc is not None:
+                for s in range(window):
+                    acc = acc * acc
+            for j in range(len(P)):
+                d = (P[j][1] >> (k * window)) & mask
+                if d:
+                    acc = T[j][d - 1] if acc is None else acc * T[j][d - 1]
+        R = acc if R is None else R * acc
+
+    if R is None:
+        return B[0] ** 0
+    return R
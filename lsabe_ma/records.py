@@ -0,0 +1,70 @@
+# .... LSABE records ...
+# Compact (__slots__) records of the scheme values that used to be anonymous tuples:
+#   ciphertext  - CT    (I, I0, I1, I2, I3, I4, I5, E1, E2, CM, AP)
+#   trapdoor    - TD    (T1, T2, T3, T4, T5)
+#   transKey    - TK    (TK2, TK3, TK4)
+#   ctOut       - CTout (CM, TI, TTI, N)
+#   aggregates  - ciphertext aggregates (E1E2m, Im, I4m), see LSABE_AUTH.AggregateGen
+#   secretKey   - SK    ((K1, K3, K4), ...) with the attributes it was issued for
+#
+# Records are positionally compatible with the tuples: they may be unpacked, indexed,
+# compared to tuples and have len(). Fields are also available by name, either as
+# attributes (CT.I5) or by key (A['Im']), so code written for the tuples and for the
+# aggregates dictionary works unchanged.
+
+class record:
+    __slots__ = ()
+
+    def __init__(self, *v):
+        if len(v) != len(self.__slots__):
+            raise TypeError(type(self).__name__ + ' takes ' + str(len(self.__slots__)) + ' values, ' + str(len(v)) + ' given')
+        for (f, x) in zip(self.__slots__, v):
+            setattr(self, f, x)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __iter__(self):
+        for f in self.__slots__:
+            yield getattr(self, f)
+
+    def __getitem__(self, i):
+        if isinstance(i, str):
+            return getattr(self, i)
+        if isinstance(i, slice):
+            return tuple(self)[i]
+        return getattr(self, self.__slots__[i])
+
+    def __eq__(self, o):
+        if isinstance(o, (tuple, record)):
+            return tuple(self) == tuple(o)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return type(self).__name__ + repr(tuple(self))
+
+class ciphertext(record):
+    __slots__ = ('I', 'I0', 'I1', 'I2', 'I3', 'I4', 'I5', 'E1', 'E2', 'CM', 'AP')
+
+class trapdoor(record):
+    __slots__ = ('T1', 'T2', 'T3', 'T4', 'T5')
+
+class transKey(record):
+    __slots__ = ('TK2', 'TK3', 'TK4')
+
+class ctOut(record):
+    __slots__ = ('CM', 'TI', 'TTI', 'N')
+
+class aggregates(record):
+    __slots__ = ('E1E2m', 'Im', 'I4m')
+
+# SK is a tuple of (K1, K3, K4), one per attribute in the order of authority attributes.
+# attrs - the attributes in the same order, None if unknown (SK files of earlier versions)
+class secretKey(tuple):
+    def __new__(cls, K, attrs = None):
+        SK = tuple.__new__(cls, K)
+        SK.attrs = None if attrs is None else tuple(attrs)
+        return SK
@@ -1,101 +1,321 @@
 # .... LSABE helper classes ...
 # SER - serializer  
 # DES - deserializer 
+#
+# Two formats:
+#   text   - group elements in charm text serialization (base64), sizes as four ASCII 
+#            digits, separated by spaces
+#   binary - header MAGIC + VERSION, then length-prefixed fields: group element is 
+#            type byte, varint length and raw (compressed) point; tuple is varint count 
+#            and elements; size is 4 bytes big endian; int is varint length and signed
+#            big endian bytes; string and base64 payload (p_b64) are varint length and raw bytes 
+# SER writes the format selected by binary flag, DES detects the format by the header,
+# so text files and messages created before binary format was introduced stay readable.
+# Binary format versions: 1 - initial, 2 - self-describing ciphertext layout (see 
+# LSABE_AUTH.serialize__CT); both are read.
 
 from base64 import b64encode, b64decode
 import re
 
+MAGIC   = b'\x89LSB'
+VERSION = 2
+HEADER  = MAGIC + bytes((VERSION, ))
+
+# Content type of binary messages at HTTP endpoints
+MIME_BINARY = 'application/x-lsabe'
+
+def is_binary(data):
+    return data[:len(MAGIC)] == MAGIC
+
+def _varint(n):
+    b = bytearray()
+    while n > 0x7f:
+        b.append((n & 0x7f) | 0x80)
+        n >>= 7
+    b.append(n)
+    return bytes(b)
+
 # .... SER - serializer .... 
 class SER():
-    def __init__(self, f, group, open = True):
+    def __init__(self, f, group, open = True, append = False, binary = False, header = True):
         # f is either a file name (open = True) 
         #    or
         # BytesIO object (open = False)
+        # append - add data to the end of the file rather than overwrite it 
+        #          (the format of existing file is kept)
+        # binary - binary format (text otherwise)
+        # header - write binary header (records that are concatenated to other data do not need it) 
         if open:
-            self.__file =f.open(mode='wb')
+            if append and f.exists() and f.stat().st_size > 0:
+                with f.open(mode='rb') as file:
+                    binary = is_binary(file.read(len(MAGIC)))
+                header = False
+            self.__file =f.open(mode='ab' if append else 'wb')
             self.__c = True
         else:
             self.__file = f
             self.__c = False
         self.__g = group
+        self.__bin = binary
+        if binary and header:
+            self.__file.write(HEADER)
 
     def __del__(self):
         if self.__c:
             self.__file.close()
 
+    @property
+    def binary(self):
+        return self.__bin
+
     def p_val(self, R):
         for v in R:
-            self.__file.write(self.__g.serialize(v))
-            self.__file.write(b' ')
+            if self.__bin:
+# charm serialization is 'type:base64'
+                (t, v) = self.__g.serialize(v).split(b':', 1)
+                self.__raw(bytes((int(t), )), b64decode(v))
+            else:
+                self.__file.write(self.__g.serialize(v))
+                self.__file.write(b' ')
         return self
 
     def p_tup(self, R):
-        self.__file.write(b'%(len)04d' %{b"len":  len(R)} )
-        self.__file.write(b' ')
+        if self.__bin:
+            self.__file.write(_varint(len(R)))
+        else:
+            self.__file.write(b'%(len)04d' %{b"len":  len(R)} )
+            self.__file.write(b' ')
         self.p_val(R)
         return self
 
     def p_bytes(self, M):
-        self.__file.write(bytes(M, "utf-8"))
-        self.__file.write(b' ')
+        if self.__bin:
+            self.__raw(b'', bytes(M, "utf-8"))
+        else:
+            self.__file.write(bytes(M, "utf-8"))
+            self.__file.write(b' ')
         return self
 
+# Base64 payload (AES ciphertext, IV); the binary format stores it decoded 
+    def p_b64(self, M):
+        if self.__bin:
+            self.__raw(b'', b64decode(M))
+            return self
+        return self.p_bytes(M)
+
     def p_size(self, sz):
-        self.__file.write(b'%(len)04d' %{b"len":  sz} )
-        self.__file.write(b' ')
+        if self.__bin:
+            self.__file.write(sz.to_bytes(4, 'big'))
+        else:
+            self.__file.write(b'%(len)04d' %{b"len":  sz} )
+            self.__file.write(b' ')
         return self
 
+    def __raw(self, prefix, b):
+        self.__file.write(prefix)
+        self.__file.write(_varint(len(b)))
+        self.__file.write(b)
+
+# Rewrites the size at the beginning of the file in place (see p_size). 
+# Returns False if the new size does not fit the width of the stored one
+    @staticmethod
+    def update_size(f, sz):
+        with f.open(mode='r+b') as file:
+            d = file.read(32)
+            if is_binary(d):
+                if sz >= 1 << 32:
+                    return False
+                file.seek(len(HEADER))
+                file.write(sz.to_bytes(4, 'big'))
+                return True
+            w = d.index(b' ')
+            v = b'%0*d' % (w, sz)
+            if len(v) != w:
+                return False
+            file.seek(0)
+            file.write(v)
+        return True
+
     def p_int(self, val):
+        if self.__bin:
+            self.__raw(b'', val.to_bytes(val.bit_length() // 8 + 1, 'big', signed = True))
+            return self
         self.p_bytes(b64encode(bytes(str(val), 'utf-8')).decode('utf-8'))
         return self
 
     def p_str(self, s):
+        if self.__bin:
+            return self.p_bytes(s)
         self.p_bytes(b64encode(bytes(s, 'utf-8')).decode('utf-8'))
         return self
 
 # .... DES - deserializer ...
+# A cursor over the buffer: tokens (text format) and fields (binary format) are parsed
+# in place, one by one, as they are requested. There is no decoding or splitting of 
+# the whole buffer, and slices of binary data are memoryviews, not copies
+_TOKEN = re.compile(rb'\s*(\S+)')
+
 class DES():
     def __init__(self, f, group, open = True):
         # f is either a file name (open = True) 
         #    or
-        # Byte buffer (open = False)
+        # Byte buffer (open = False): bytes, bytearray, memoryview, mmap
         if open:
-            file =f.open(mode='rb')
-            data = file.read().decode('utf-8')
-            file.close
+            with f.open(mode='rb') as file:
+                f = file.read()
+        self.__d = memoryview(f)
+        self.__bin = is_binary(self.__d)
+        if self.__bin:
+            if len(self.__d) < len(HEADER):
+                raise ValueError('Truncated serialization format header')
+            if self.__d[len(MAGIC)] > VERSION:
+                raise ValueError('Unsupported serialization format version ' + str(self.__d[len(MAGIC)]))
+            self.__i = len(HEADER)
         else:
-            data = f.decode('utf-8')
-        self.__d = data.split()
-        self.__i = 0
+            self.__i = 0
         self.__g = group
 
+    @property
+    def binary(self):
+        return self.__bin
+
+# Binary format version, None for text format
+    @property
+    def version(self):
+        return self.__d[len(MAGIC)] if self.__bin else None
+
     def g_val(self, n):
-        R = ()
+        R = []
         for i in range(0, n):     
-            R = R +(self.__g.deserialize(self.__d[self.__i].encode()),)
-            self.__i = self.__i + 1
-        return R
+            if self.__bin:
+                t = self.__take(1)[0]
+                R.append(self.__g.deserialize(b'%d:' % t + b64encode(self.__raw())))
+            else:
+                R.append(self.__g.deserialize(self.__token()))
+        return tuple(R)
 
     def g_tup(self):
-        sz = int(self.__d[self.__i])
-        self.__i = self.__i + 1
-        return self.g_val(sz)
+        if self.__bin:
+            return self.g_val(self.__varint())
+        return self.g_val(int(self.__token()))
 
     def g_bytes(self):
-        self.__i = self.__i + 1
-        return self.__d[self.__i - 1]
+        if self.__bin:
+            return str(self.__raw(), 'utf-8')
+        return self.__token().decode('utf-8')
+
+# Base64 payload, see SER.p_b64
+    def g_b64(self):
+        if self.__bin:
+            return b64encode(self.__raw()).decode('utf-8')
+        return self.g_bytes()
 
     def g_size(self):
-        sz = int(self.__d[self.__i])
-        self.__i = self.__i + 1
-        return sz
+        if self.__bin:
+            return int.from_bytes(self.__take(4), 'big')
+        return int(self.__token())
 
     def g_int(self):
-        val = int(b64decode(self.__d[self.__i]).decode('utf-8'))
-        self.__i = self.__i + 1
-        return val
+        if self.__bin:
+            return int.from_bytes(self.__raw(), 'big', signed = True)
+        return int(b64decode(self.__token()).decode('utf-8'))
 
     def g_str(self):
-        s = b64decode(self.__d[self.__i]).decode('utf-8')
-        self.__i = self.__i + 1
-        return s
+        if self.__bin:
+            return self.g_bytes()
+        return b64decode(self.__token()).decode('utf-8')
+
+    def eof(self):
+        if self.__bin:
+            return self.__i >= len(self.__d)
+        return _TOKEN.match(self.__d, self.__i) is None
+
+# Cursor position, so that a part of data may be skipped and decoded later (seek) 
+    def tell(self):
+        return self.__i
+
+    def seek(self, i):
+        self.__i = i
+        return self
+
+# Skip n values or a tuple without decoding 
+    def skip_val(self, n):
+        for i in range(0, n):     
+            if self.__bin:
+                self.__take(1)
+                self.__raw()
+            else:
+                self.__token()
+        return self
+
+    def skip_tup(self):
+        if self.__bin:
+            return self.skip_val(self.__varint())
+        return self.skip_val(int(self.__token()))
+
+# Skip n strings or base64 payloads (p_str, p_bytes, p_b64) without decoding
+    def skip_str(self, n):
+        for i in range(0, n):
+            if self.__bin:
+                self.__raw()
+            else:
+                self.__token()
+        return self
+
+# The next token as is, None at the end of data (text format)
+    def peek(self):
+        m = _TOKEN.match(self.__d, self.__i)
+        return None if m is None else m.group(1).decode('utf-8')
+
+    def __token(self):
+        m = _TOKEN.match(self.__d, self.__i)
+        if m is None:
+            raise ValueError('Unexpected end of data')
+        self.__i = m.end()
+        return m.group(1)
+
+    def __varint(self):
+        n = 0
+        s = 0
+        while True:
+            b = self.__take(1)[0]
+            n |= (b & 0x7f) << s
+            if b < 0x80:
+                return n
+            s += 7
+
+    def __raw(self):
+        return self.__take(self.__varint())
+
+# The next n bytes (binary format), ValueError if data ends before
+    def __take(self, n):
+        if self.__i + n > len(self.__d):
+            raise ValueError('Unexpected end of data')
+        self.__i = self.__i + n
+        return self.__d[self.__i - n:self.__i]
+
+# .... Framed stream of messages (binary HTTP responses) ...
+# A frame is kind (one byte), payload length (4 bytes big endian) and payload
+def p_frame(kind, payload):
+    return kind + len(payload).to_bytes(4, 'big') + payload
+
+# Yields (kind, payload) from an iterable of byte chunks of arbitrary size
+# Chunks are appended to a single buffer and frames are read at offset o; consumed data 
+# is dropped only when it takes more than a half of the buffer, so the buffer is not 
+# copied per frame
+def g_frames(chunks):
+    buf = bytearray()
+    o = 0
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) - o >= 5:
+            sz = int.from_bytes(buf[o + 1:o + 5], 'big')
+            if len(buf) - o < 5 + sz:
+                break
+            yield (bytes(buf[o:o + 1]), bytes(buf[o + 5:o + 5 + sz]))
+            o = o + 5 + sz
+        if o > len(buf) // 2:
+            del buf[:o]
+            o = 0
+    if len(buf) > o:
+        raise ValueError('Truncated frame')
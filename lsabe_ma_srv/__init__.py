@@ -1,7 +1,7 @@
 import lsabe_ma_srv.storage
 
-def create_app():
-    app = lsabe_ma_srv.storage.create_app() 
+def create_app(key_path = None, data_path = None):
+    app = lsabe_ma_srv.storage.create_app(key_path, data_path) 
     return app
 
 
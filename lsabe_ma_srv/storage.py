@@ -4,45 +4,128 @@ import time
 import pathlib
 import random
 import string
+import json
+import threading
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from lsabe_ma.lsabe_ma import LSABE_MA
 from lsabe_ma.lsabe_authority import LSABE_AUTH
+from lsabe_ma.keywordMatrix import keywordMatrix
+from lsabe_ma.serializer import MIME_BINARY, p_frame
+from charm.toolbox.pairinggroup import ZR
 
 
-def create_app():
+# key_path  - MSK, PP and authority files (default: keys next to the package)
+# data_path - stored cyphertexts, their aggregates and registered GIDs (default: storage next to the package)
+def create_app(key_path = None, data_path = None):
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
 
+# The maximum number of keywords is loaded from PP, this value is used for PP files
+# that were created before it was stored there
     MAX_KEYWORDS = 10
     default_authority_id = 1
-    key_path = pathlib.Path(__file__).parent.parent.joinpath('keys')
-    data_path = pathlib.Path(__file__).parent.parent.joinpath('storage')
+    if key_path is None:
+        key_path = pathlib.Path(__file__).parent.parent.joinpath('keys')
+    if data_path is None:
+        data_path = pathlib.Path(__file__).parent.parent.joinpath('storage')
 
 
     KGC  =  LSABE_MA(key_path, MAX_KEYWORDS)
     AUTH =  LSABE_AUTH(key_path, MAX_KEYWORDS, default_authority_id)
+# Access policy (A,ρ) selects the rows used by search and transform
+    AUTH.PolicyLoad()
 
     dir_create(data_path)
-    data = set()
+# Stored cyphertexts and their aggregates (see LSABE_AUTH.AggregateGen)
+    data = {}
+# I5 of stored cyphertexts
+    index = keywordMatrix(AUTH.group)
+# Registered GIDs and materialized search values (see LSABE_AUTH.SearchValueGen)
+# gids:    GID -> serialized H(GID)
+# columns: serialized H(GID) -> { cyphertext : I0^H(GID) * I1 }
+    gids_fname = data_path.joinpath('registered.gid')
+    gids = {}
+    columns = {}
+# data, index, gids and columns are changed under the lock (request handlers may run
+# concurrently); /search works on a snapshot taken under the lock
+    lock = threading.RLock()
 
+    def materialize(ct, hGID, ctds = None):
+        if ctds is None:
+            ctds = AUTH.deserialize__CT(ct, False)
+        columns[AUTH.group.serialize(hGID)][ct] = AUTH.SearchValueGen(ctds, hGID)
 
-    try:
+# The column is published before data is read, so cyphertexts stored meanwhile are
+# materialized by /store. Search values of the snapshot are computed outside the lock
+# (/search computes the values that are not there yet)
+    def register_gid(GID):
+        hGID = AUTH.group.hash(GID, ZR)
+        k = AUTH.group.serialize(hGID)
+        with lock:
+            gids[GID] = k
+            column = columns[k] = {}
+            cts = list(data)
+        for ct in cts:
+            column[ct] = AUTH.SearchValueGen(AUTH.deserialize__CT(ct, False), hGID)
+
+    def save_gids():
+        f = open(gids_fname, 'w')
+        for GID in gids:
+            f.write(GID + '\n')
+        f.close()
+
+# Loads stored cyphertexts, their aggregates and I5 to data and index, drops materialized
+# search values (at startup and after global setup that may change the pairing group).
+# Cyphertexts that cannot be parsed with current PP (e.g. created for another curve) 
+# are skipped and kept in file storage.
+# Returns the numbers of loaded and skipped cyphertexts
+    def load_messages():
+        nonlocal index
+        data.clear()
+        index = keywordMatrix(AUTH.group)
+        for column in columns.values():
+            column.clear()
         msg_files = [f for f in os.listdir(str(data_path)) if f.endswith('.ciphertext')]
         numfiles = 0
+        numerr = 0
         for msg_file in msg_files:
             ct_fname = data_path.joinpath(msg_file)
             f = open(ct_fname, 'rb')
             d = f.read()
-            data.add(d) 
-            f.close 
+            f.close()
+            try:
+                A = load_aggregate(AUTH, d, ct_fname.with_suffix('.aggregate'))
+                index.add(d, AUTH.deserialize__CT(d, False, lazy = True)[6])
+            except:
+                numerr += 1
+                continue
+            data[d] = A
             numfiles +=1 
+        return (numfiles, numerr)
 
+    try:
+        (numfiles, numerr) = load_messages()
         print(str(numfiles) + ' encrypted messages loaded')
+        if numerr > 0:
+            print(str(numerr) + ' encrypted messages skipped (cannot be parsed with current PP)')
     except:
         print('Failed to load messages from file storage')
         exit (-1)
 
+    try:
+        if gids_fname.exists():
+            f = open(gids_fname, 'r')
+            Lines = f.readlines()
+            f.close()
+            for line in Lines:
+                if line.strip():
+                    register_gid(line.strip())
+            print(str(len(gids)) + ' registered GIDs loaded')
+    except:
+        print('Failed to load registered GIDs')
+        exit (-1)
+
 
 
     # ------------------------------------------------
@@ -61,19 +144,28 @@ def create_app():
             msk = request.files['MSK']
             pp  = request.files['PP']
             try:
-                msk.save(app.KGC.msk_file())
-                pp.save(app.KGC.msk_file())
+                msk.save(KGC.msk_fname)
+                pp.save(KGC.pp_fname)
             except:
                 return 'Failed to save MSK and PP',500
+# PP may bring another curve and maximum number of keywords: stored cyphertexts, I5 index
+# and search values of registered GIDs are rebuilt for the new group
             try:    
-                KGC  =  LSABE_MA(key_path, MAX_KEYWORDS)
-                AUTH =  LSABE_AUTH(key_path, MAX_KEYWORDS, default_authority_id)
+                with lock:
+                    KGC.GlobalLoad()
+                    AUTH.GlobalLoad()
+                    AUTH.PolicyLoad()
+                    load_messages()
+                    columns.clear()
+                    for GID in list(gids):
+                        register_gid(GID)
             except:
                 return 'Failed to apply MSK and PP',500
         return 'Global setup succesfully updated', 200
 
     # ------------------------------------------------
     # Update authority setup parameters
+    # POL (access policy) is optional, the default policy is used if it is not provided
     @app.route('/authority-setup', methods=['POST'])
     @app.route('/authority-setup/<authority_id>', methods=['POST'])
     def authoritySetup(authority_id=1):
@@ -87,15 +179,19 @@ def create_app():
             apk = request.files['APK']
             att = request.files['ATT']
             try:
-                ask.save(app.AUTH.ask_file())
-                apk.save(app.AUTH.apk_file())
-                att.save(app.AUTH.att_file())
+                ask.save(AUTH.ask_fname)
+                apk.save(AUTH.apk_fname)
+                att.save(AUTH.att_fname)
+                if 'POL' in request.files:
+                    request.files['POL'].save(AUTH.pol_fname)
+                elif os.path.exists(AUTH.pol_fname):
+                    os.remove(AUTH.pol_fname)
             except:
-                return 'Failed to save ASK, APK and ATT',500
+                return 'Failed to save ASK, APK, ATT and POL',500
             try:    
-                AUTH =  LSABE_AUTH(key_path, MAX_KEYWORDS, default_authority_id)
+                AUTH.PolicyLoad()
             except:
-                return 'Failed to apply ASK, APK and ATT',500
+                return 'Failed to apply access policy',500
         return 'Authority setup succesfully updated', 200
 
     # ------------------------------------------------
@@ -106,64 +202,173 @@ def create_app():
             return "Cyphertext required", 422
         else:
             CT = request.files['CT'].stream.read()
-            data.add(CT)
+            try:
+                ctds = AUTH.deserialize__CT(CT, False)
+                A = AUTH.AggregateGen(ctds)
+            except:
+                return "Failed to parse cyphertext", 422
+# The cyphertext is published to data last: /search takes a snapshot of data and 
+# expects every cyphertext of the snapshot to be in the index already
+            with lock:
+                index.add(CT, ctds[6])
+                for k in list(columns):
+                    materialize(CT, AUTH.group.deserialize(k), ctds)
+                data[CT] = A
             ct_name = ''.join(random.choice(string.ascii_letters) for _ in range(8))
             ct_fname = data_path.joinpath(ct_name + '.ciphertext')   
             f = open(ct_fname, 'wb')
             f.write(CT)
             f.close()
+            AUTH.serialize__CTA(A, ct_fname.with_suffix('.aggregate'))
 
         return 'Cyphertext stored', 200
 
+    # ------------------------------------------------
+    # Corpus statistics
+    # degree - the highest number of I5 coefficients, the trapdoor does not need more T4 values  
+    @app.route('/corpus-stats', methods=['GET'])
+    def corpusStats():
+        return jsonify({'messages': len(data), 'degree': index.degree}), 200
+
     # ------------------------------------------------
     # Search cyphertext (apply trapdoor, etc )
     @app.route('/search', methods=['GET'])
     def search():
-        res = False
-        rsp = []
-        search_time = 0
-        transform_time = 0
-        total_time = time.time()
-        encrypted_size = 0
-        transformed_size = 0
         if 'TD' not in request.files:
             return "Trapdoor is required", 422
         if 'TK' not in request.files:
             return "Transformation key is required", 422
         td = request.files['TD'].stream.read()
         tk = request.files['TK'].stream.read()
-        for ct in data:
-            encrypted_size += len(ct)
-            ctds = AUTH.deserialize__CT(ct, False)
+        try:
+            Q = AUTH.PrepareQuery(AUTH.deserialize__TD(td, False), AUTH.deserialize__TK(tk, False), request.form.getlist('ATTR'))
+        except:
+            return "Failed to parse trapdoor or transformation key", 422
+
+# The trapdoor shall have T4 values for I5 of every stored cyphertext. If a document with
+# more keywords was stored after the client had read the degree (/corpus-stats), the
+# search would silently miss it, so the request is rejected with the current degree 
+# and the client generates the trapdoor again
+        if len(Q['TD'][3]) < index.degree:
+            return jsonify({'messages': len(data), 'degree': index.degree}), 409
+
+        stats = {'total_time': 0, 'search_time': 0, 'transform_time': 0, 'encrypted_size': 0, 'transformed_size': 0}
+        start = time.time()
+        with lock:
+            column = columns.get(AUTH.group.serialize(Q['TD'][1]))
+            items = list(data.items())
             tms = time.time()
-            r = AUTH.Search(ctds, AUTH.deserialize__TD(td, False))
-            search_time += (time.time() - tms)
-            res = res or r
-            if r:
-                tmt = time.time()
-                CTout = AUTH.Transform(ctds, AUTH.deserialize__TK(tk, False))
-                transform_time += (time.time() - tmt)
-                cts = io.BytesIO()
-                AUTH.serialize__CTout(CTout, cts, False)
-                transformed_size += len(cts.getvalue())
-                rsp.append(cts.getvalue().decode('ascii'))      
-
-        total_time = time.time()-total_time
-        if res:
-            return jsonify({'CTout': rsp,
-                            'total_time': total_time*1000,
-                            'search_time': search_time*1000,
-                            'transform_time': transform_time*1000,
-                            'encrypted_size': encrypted_size,
-                            'transformed_size': transformed_size}), 200
+            try:
+                T4m = index.product(Q['TD'][3])
+            except ValueError:
+# Such a document was stored after the check above
+                return jsonify({'messages': len(data), 'degree': index.degree}), 409
+            position = index.position
+        stats['search_time'] += (time.time() - tms)
+
+# Response format: binary if the client accepts it, text (JSON, NDJSON) otherwise.
+# TD and TK of either format are accepted
+        accept = request.headers.get('Accept', '')
+        binary = MIME_BINARY in accept
+
+# Serialized CTouts of matching cyphertexts, one by one
+        def results():
+            for ct, A in items:
+                stats['encrypted_size'] += len(ct)
+                ctds = AUTH.deserialize__CT(ct, False, lazy = True)
+                tms = time.time()
+                r = AUTH.SearchPrepared(ctds, Q, A, None if column is None else column.get(ct), T4m[position(ct)])
+                stats['search_time'] += (time.time() - tms)
+                if r:
+                    tmt = time.time()
+                    CTout = AUTH.TransformPrepared(ctds, Q, A)
+                    stats['transform_time'] += (time.time() - tmt)
+                    cts = io.BytesIO()
+                    AUTH.serialize__CTout(CTout, cts, False, binary)
+                    stats['transformed_size'] += len(cts.getvalue())
+                    yield cts.getvalue() if binary else cts.getvalue().decode('ascii')
+            stats['total_time'] = time.time() - start
+
+        def timings():
+            return { k: v * 1000 if k.endswith('_time') else v for k, v in stats.items() }
+
+# Streaming binary response: a frame 'C' with binary CTout per matching message as soon 
+# as it is transformed, then a frame 'S' with timings, sizes and the number of messages 
+# (JSON)
+        if binary:
+            def stream_binary():
+                n = 0
+                for cts in results():
+                    n += 1
+                    yield p_frame(b'C', cts)
+                rsp = timings()
+                rsp['nmsg'] = n
+                yield p_frame(b'S', json.dumps(rsp).encode('utf-8'))
+            return Response(stream_with_context(stream_binary()), mimetype = MIME_BINARY)
+
+# Streaming (NDJSON) response: a line {"CTout": ...} per matching message as soon as it
+# is transformed, then a line with timings and sizes. The client starts decryption 
+# while the response is still being received
+        if 'application/x-ndjson' in accept:
+            def stream():
+                n = 0
+                for cts in results():
+                    n += 1
+                    yield json.dumps({'CTout': cts}) + '\n'
+                rsp = timings()
+                rsp['nmsg'] = n
+                yield json.dumps(rsp) + '\n'
+            return Response(stream_with_context(stream()), mimetype = 'application/x-ndjson')
+
+        rsp = list(results())
+        if len(rsp) > 0:
+            R = timings()
+            R['CTout'] = rsp
+            return jsonify(R), 200
             
         return 'Message was not found.', 404
 
+    # ------------------------------------------------
+    # Register GID with heavy query load (materialize search values for this GID)
+    @app.route('/register-gid', methods=['POST'])
+    def registerGID():
+        GID = request.form.get('GID')
+        if GID is None or not GID.strip():
+            return 'User identity (GID) is required', 422
+        GID = GID.strip()
+        if GID not in gids:
+            register_gid(GID)
+            try:
+                with lock:
+                    save_gids()
+            except:
+                return 'Failed to save registered GIDs', 500
+        return 'GID succesfully registered', 200
+
+    # ------------------------------------------------
+    # Unregister GID (drop materialized search values for this GID)
+    @app.route('/unregister-gid', methods=['POST'])
+    def unregisterGID():
+        GID = request.form.get('GID')
+        with lock:
+            if GID is None or GID.strip() not in gids:
+                return 'GID is not registered', 404
+            del columns[gids.pop(GID.strip())]
+            try:
+                save_gids()
+            except:
+                return 'Failed to save registered GIDs', 500
+        return 'GID succesfully unregistered', 200
+
 # ------------------------------------------------
 # Delete messages
     @app.route('/clear-messages', methods=['GET'])
     def clear_messages():
-        data.clear()
+        with lock:
+            data.clear()
+            index.clear()
+            for column in columns.values():
+                column.clear()
         dir_create(data_path)
         msg_files = [f for f in os.listdir(str(data_path)) if f.endswith('.ciphertext')]
         nDel = 0
@@ -175,11 +380,30 @@ def create_app():
                 nDel += 1
             except:
                 nErr += 1
+        for cta_file in [f for f in os.listdir(str(data_path)) if f.endswith('.aggregate')]:
+            try:
+                os.remove(data_path.joinpath(cta_file))
+            except:
+                pass
         return jsonify({'nDel': nDel, 'nErr': nErr}), 200
 
     return app
 
 
+# Loads cyphertext aggregates from the file next to cyphertext.
+# If the file is missing or damaged, aggregates are computed and the file is recreated
+def load_aggregate(AUTH, ct, cta_fname):
+    try:
+        return AUTH.deserialize__CTA(cta_fname)
+    except:
+        pass
+    A = AUTH.AggregateGen(AUTH.deserialize__CT(ct, False))
+    try:
+        AUTH.serialize__CTA(A, cta_fname)
+    except:
+        pass
+    return A
+
 def dir_create(pth):
     try:
         pth.mkdir(mode=0o777, parents=True, exist_ok=True)
@@ -0,0 +1,63 @@
+# .... accessPolicy: policy compiler and reconstruction coefficients ...
+
+import pytest
+
+from lsabe_ma.accessPolicy import accessPolicy
+
+R = 2 ** 61 - 1                     # A prime, stands for the group order
+
+def reconstruct(ap, C):
+    return [sum(w * ap.A(i, j) for (i, w) in C) % R for j in range(ap.n)]
+
+@pytest.mark.parametrize('policy, attrs', [
+    ('a', ['a']),
+    ('a and b', ['a', 'b']),
+    ('a or b', ['b']),
+    ('(doctor and cardiology) or admin', ['doctor', 'cardiology']),
+    ('(doctor and cardiology) or admin', ['admin']),
+    ('a and (b or c) and d', ['a', 'c', 'd']),
+    ('"x y" AND z', ['x y', 'z']),
+])
+def test_satisfied(policy, attrs):
+    ap = accessPolicy(policy, R)
+    C = ap.coefficients(frozenset(attrs))
+    assert C is not None
+    assert reconstruct(ap, C) == [1] + [0] * (ap.n - 1)
+    assert {ap.p(i) for (i, w) in C} <= set(attrs)
+
+@pytest.mark.parametrize('policy, attrs', [
+    ('a and b', ['a']),
+    ('a and b', ['b']),
+    ('(doctor and cardiology) or admin', ['doctor']),
+    ('a and (b or c) and d', ['a', 'b', 'c']),
+    ('a', []),
+])
+def test_not_satisfied(policy, attrs):
+    assert accessPolicy(policy, R).coefficients(frozenset(attrs)) is None
+
+def test_shares():
+    ap = accessPolicy('(a and b) or (c and d and e)', R)
+    v = ap.randVector()
+    for attrs in (['a', 'b'], ['c', 'd', 'e']):
+        C = ap.coefficients(frozenset(attrs))
+        assert sum(w * ap.lmbda(i, v) for (i, w) in C) % R == v[0] % R
+
+def test_zero_shares():
+    ap = accessPolicy('a and b and c', R)
+    o = ap.randVector(zero = True)
+    assert o[0] == 0
+    C = ap.coefficients(frozenset(['a', 'b', 'c']))
+    assert sum(w * ap.lmbda(i, o) for (i, w) in C) % R == 0
+    assert any(ap.lmbda(i, o) % R for i in range(ap.l))
+
+@pytest.mark.parametrize('policy', ['', 'a and', '(a or b', 'a or b)', 'a ! b'])
+def test_invalid(policy):
+    with pytest.raises(ValueError):
+        accessPolicy(policy, R)
+
+def test_stub():
+    ap = accessPolicy()
+    assert not ap.compiled
+    assert (ap.n, ap.l) == (2, 5)
+    v = ap.randVector()
+    assert all(ap.lmbda(i, v) == v[0] for i in range(ap.l))
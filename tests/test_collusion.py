@@ -0,0 +1,58 @@
+# .... Compiled access policy: users with different GIDs can not pool their attributes ...
+
+import pytest
+
+pytest.importorskip('charm')
+
+from charm.toolbox.pairinggroup import ZR, pair
+
+from lsabe_ma.lsabe_ma import LSABE_MA
+from lsabe_ma.lsabe_authority import LSABE_AUTH
+from lsabe_ma.accessPolicy import accessPolicy
+from lsabe_ma.records import ctOut
+
+MSG = 'top secret'
+
+@pytest.fixture
+def auth(tmp_path):
+    LSABE_MA(tmp_path, 10).GlobalSetup()
+    LSABE_AUTH(tmp_path, 10, 1).AuthoritySetup(['a1', 'a2'])
+    a = LSABE_AUTH(tmp_path, 10, 1)
+    a.AuthorityLoad()
+    a.AuthorityPolicy('a1 and a2')
+    return a
+
+# Opens the rows of attrs with the keys of GID: Upsilon * e(g,g)^(alfa*r(i)) / e(g,g)^(alfa*r(i))
+# for every row and combines them with the reconstruction coefficients, like Transform does
+def combine(auth, CT, holders):
+    one = auth.group.init(ZR, 1)
+    ap = accessPolicy(auth.policy, auth.group.order())
+    rows = {}
+    for (GID, attr) in holders:
+        ((K1, K3, K4), ) = auth.SecretKeyGen(GID, [attr])
+        (H, TK3, TK4) = auth.TransKeyGen(((K1, K3, K4), ), one, GID)
+        i = next(i for i in range(ap.l) if ap.p(i) == attr)
+        rows[i] = (CT.I[i], pair(CT.I2[i], K4) * pair(CT.I3, K3) / pair(CT.I4[i], H))
+    (TTI, TI) = (None, None)
+    for (i, w) in ap.coefficients(frozenset(attr for (GID, attr) in holders)):
+        (Ii, Di) = (rows[i][0] ** w, rows[i][1] ** w)
+        (TTI, TI) = (Ii, Di) if TTI is None else (TTI * Ii, TI * Di)
+    return auth.DecryptMany(one, [ctOut(CT.CM, TI, TTI, 1)])[0]
+
+def test_single_user(auth):
+    CT = auth.EncryptAndIndexGen(MSG, ['k'])
+    assert combine(auth, CT, [('alice', 'a1'), ('alice', 'a2')]) == MSG
+
+def test_collusion(auth):
+    CT = auth.EncryptAndIndexGen(MSG, ['k'])
+    assert combine(auth, CT, [('alice', 'a1'), ('bob', 'a2')]) != MSG
+
+def test_search(auth):
+    CT = auth.EncryptAndIndexGen(MSG, ['k'])
+    SK = auth.SecretKeyGen('carol', ['a1', 'a2'])
+    z = auth.z()
+    Q = auth.PrepareQuery(auth.TrapdoorGen(SK, 'carol', ['k']), auth.TransKeyGen(SK, z, 'carol'), ['a1', 'a2'])
+    assert auth.SearchPrepared(CT, Q)
+    assert auth.Decrypt(z, auth.TransformPrepared(CT, Q)) == MSG
+    Q = auth.PrepareQuery(auth.TrapdoorGen(SK, 'carol', ['k']), auth.TransKeyGen(SK, z, 'carol'), ['a1'])
+    assert auth.TransformPrepared(CT, Q) is None
@@ -0,0 +1,85 @@
+# .... ctView: lazy ciphertext decodes fields on first access ...
+
+import io
+
+import pytest
+
+pytest.importorskip('charm')
+
+from lsabe_ma.lsabe_ma import LSABE_MA
+from lsabe_ma.lsabe_authority import LSABE_AUTH
+from lsabe_ma.serializer import SER, MAGIC
+
+# The default (stub) policy is exercised with a single attribute
+POLICIES = { None: ['a1'], 'a1 and (a2 or a3)': ['a1', 'a2', 'a3'] }
+
+@pytest.fixture(params = list(POLICIES))
+def policy(request):
+    return request.param
+
+def authority(path, policy, binary = True):
+    LSABE_MA(path, 10).GlobalSetup()
+    LSABE_AUTH(path, 10, 1).AuthoritySetup(POLICIES[policy])
+    a = LSABE_AUTH(path, 10, 1, binary = binary)
+    a.AuthorityLoad()
+    a.AuthorityPolicy(policy)
+    return a
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_view(tmp_path, policy, binary):
+    auth = authority(tmp_path, policy, binary)
+    CT = auth.EncryptAndIndexGen('message', ['k1', 'k2'])
+    b = io.BytesIO()
+    auth.serialize__CT(CT, b, False)
+    V = auth.deserialize__CT(b.getvalue(), False, lazy = True)
+    assert not any(V.decoded(i) for i in range(len(V)))
+    assert V[6] == CT[6]
+    assert [i for i in range(len(V)) if V.decoded(i)] == [6]
+    assert V[9] == CT[9]
+    assert V[-1] == CT[10] == policy
+    assert tuple(V) == tuple(CT)
+
+def test_search(tmp_path, policy):
+    auth = authority(tmp_path, policy)
+    CT = auth.EncryptAndIndexGen('message', ['k1', 'k2'])
+    b = io.BytesIO()
+    auth.serialize__CT(CT, b, False)
+    V = auth.deserialize__CT(b.getvalue(), False, lazy = True)
+    attrs = POLICIES[policy]
+    SK = auth.SecretKeyGen('u', attrs)
+    z = auth.z()
+    Q = auth.PrepareQuery(auth.TrapdoorGen(SK, 'u', ['k2']), auth.TransKeyGen(SK, z, 'u'), attrs)
+    T4m = int(sum((CT[6][j] * Q['TD'][3][j] for j in range(1, len(CT[6]))), CT[6][0] * Q['TD'][3][0]))
+    assert auth.SearchPrepared(V, Q, T4m = T4m)
+    assert not V.decoded(6)
+    assert auth.Decrypt(z, auth.TransformPrepared(V, Q)) == 'message'
+
+# Earlier versions: I2 is a single group element, there is no AP (the default policy)
+@pytest.mark.parametrize('binary', [False, True])
+def test_legacy(tmp_path, binary):
+    auth = authority(tmp_path, None, binary)
+    CT = auth.EncryptAndIndexGen('message', ['k1'])
+    (I, I0, I1, I2, I3, I4, I5, E1, E2, CM, AP) = CT
+    b = io.BytesIO()
+    l = SER(b, auth.group, False, binary = binary, header = False)
+    if binary:
+        b.write(MAGIC + bytes((1, )))
+    l.p_tup(I).p_val((I0, I1) + I2 + (I3, )).p_tup(I4).p_tup(I5).p_val((E1,)).p_tup(E2).p_b64(CM[0]).p_b64(CM[1])
+    assert tuple(auth.deserialize__CT(b.getvalue(), False)) == tuple(CT)
+    assert tuple(auth.deserialize__CT(b.getvalue(), False, lazy = True)) == tuple(CT)
+
+# A ciphertext of another policy is parsed, but it neither matches nor is transformed
+def test_policy_switch(tmp_path, policy):
+    auth = authority(tmp_path, policy)
+    CT = auth.EncryptAndIndexGen('message', ['k1'])
+    b = io.BytesIO()
+    auth.serialize__CT(CT, b, False)
+    auth.AuthorityPolicy('a1' if policy is None else None)
+    attrs = POLICIES[policy]
+    SK = auth.SecretKeyGen('u', attrs)
+    z = auth.z()
+    Q = auth.PrepareQuery(auth.TrapdoorGen(SK, 'u', ['k1']), auth.TransKeyGen(SK, z, 'u'), attrs)
+    for V in (auth.deserialize__CT(b.getvalue(), False), auth.deserialize__CT(b.getvalue(), False, lazy = True)):
+        assert V[10] == policy
+        assert not auth.SearchPrepared(V, Q)
+        assert auth.TransformPrepared(V, Q) is None
@@ -0,0 +1,34 @@
+# .... Keyword polynomial helpers ...
+
+import random
+
+import pytest
+
+from lsabe_ma.formuleDeViete import formuleDeViete, polyFromRoots, polyMul, polyVal, powerSums
+
+R = 2 ** 61 - 1
+
+@pytest.mark.parametrize('n', [0, 1, 2, 7, 8, 9, 33, 300])
+def test_polyFromRoots(n):
+    rnd = random.Random(n)
+    roots = [rnd.randrange(R) for i in range(n)]
+    P = polyFromRoots(roots, R)
+    assert len(P) == n + 1 and P[n] == 1
+    assert [c % R for c in formuleDeViete(roots)] == P
+    for x in roots[:5]:
+        assert polyVal(P, x) % R == 0
+
+def test_polyMul():
+    rnd = random.Random(1)
+    for (n, m) in ((1, 1), (3, 20), (8, 8), (50, 17)):
+        a = [rnd.randrange(R) for i in range(n)]
+        b = [rnd.randrange(R) for i in range(m)]
+        c = [0] * (n + m - 1)
+        for i in range(n):
+            for j in range(m):
+                c[i + j] += a[i] * b[j]
+        assert polyMul(a, b, R) == [x % R for x in c]
+
+def test_powerSums():
+    x = [2, 3, R - 1]
+    assert powerSums(x, 4, R) == [sum(pow(v, j, R) for v in x) % R for j in range(4)]
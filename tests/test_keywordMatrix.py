@@ -0,0 +1,52 @@
+# .... keywordMatrix: T4m of the whole corpus ...
+
+import random
+
+import pytest
+
+from lsabe_ma import keywordMatrix as km
+
+R = 2 ** 61 - 1
+
+class group:
+    def order(self):
+        return R
+
+@pytest.fixture(params = ['numpy', 'lists'])
+def matrix(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(km, 'numpy', None)
+    return km.keywordMatrix(group())
+
+def test_product(matrix):
+    rnd = random.Random(1)
+    I5 = {}
+    for c in range(20):
+        I5['ct%d' % c] = [rnd.randrange(R) for j in range(rnd.randrange(1, 6))]
+        matrix.add('ct%d' % c, I5['ct%d' % c])
+    matrix.add('ct0', [1, 2, 3, 4, 5, 6, 7])
+    assert len(matrix) == 20
+    assert matrix.degree == max(len(v) for v in I5.values())
+
+    T4 = [rnd.randrange(R) for j in range(matrix.degree + 2)]
+    T4m = matrix.product(T4)
+    for (key, v) in I5.items():
+        assert T4m[matrix.position(key)] == sum(a * t for (a, t) in zip(v, T4)) % R
+
+    matrix.add('late', [1] * (matrix.degree + 1))
+    assert matrix.product(T4)[matrix.position('late')] == sum(T4[:matrix.degree]) % R
+
+def test_short_trapdoor(matrix):
+    matrix.add('ct', [1, 2, 3])
+    with pytest.raises(ValueError):
+        matrix.product([1, 2])
+    assert matrix.product([1, 1, 1]) == [6]
+
+def test_empty(matrix):
+    assert matrix.degree == 0
+    assert matrix.product([]) == []
+    matrix.add('ct', [5])
+    matrix.clear()
+    assert (len(matrix), matrix.degree) == (0, 0)
@@ -0,0 +1,74 @@
+# .... SK and keystore record the attributes SK was issued for ...
+
+import pytest
+
+pytest.importorskip('charm')
+
+from lsabe_ma.lsabe_ma import LSABE_MA
+from lsabe_ma.lsabe_authority import LSABE_AUTH
+from lsabe_ma.serializer import SER
+
+MSG = 'top secret'
+
+def authority(tmp_path, binary):
+    LSABE_MA(tmp_path, 10, binary = binary).GlobalSetup()
+    LSABE_AUTH(tmp_path, 10, 1, binary = binary).AuthoritySetup(['a1', 'a2', 'a3'])
+    a = LSABE_AUTH(tmp_path, 10, 1, binary = binary)
+    a.AuthorityLoad()
+    return a
+
+@pytest.fixture(params = [True, False], ids = ['binary', 'text'])
+def auth(tmp_path, request):
+    return authority(tmp_path, request.param)
+
+def test_sk_round_trip(auth, tmp_path):
+    SK = auth.SecretKeyGen('alice', ['a3', 'a1', 'a3'])
+    assert SK.attrs == ('a1', 'a3')
+    auth.serialize__SK(SK, tmp_path.joinpath('alice.sk'))
+    L = auth.deserialize__SK(tmp_path.joinpath('alice.sk'))
+    assert L == SK
+    assert L.attrs == SK.attrs
+
+# SK files of earlier versions end after the keys
+def test_sk_legacy(auth, tmp_path):
+    SK = auth.SecretKeyGen('alice', ['a1', 'a2'])
+    l = SER(tmp_path.joinpath('alice.sk'), auth.group, binary = auth.binary)
+    l.p_size(len(SK))
+    for K in SK:
+        l.p_val(K)
+    del l
+    L = auth.deserialize__SK(tmp_path.joinpath('alice.sk'))
+    assert L == SK
+    assert L.attrs is None
+    assert auth.KeyAttributes(['a2', 'a1'], L) == ['a1', 'a2']
+    with pytest.raises(ValueError):
+        auth.KeyAttributes(['a1'], L)
+
+def test_ks_round_trip(auth, tmp_path):
+    users = [('alice', ['a1']), ('bob', ['a2', 'a3']), ('carol', [])]
+    auth.SecretKeyGenBulk(users, tmp_path.joinpath('users.ks'))
+    KS = auth.deserialize__KS(tmp_path.joinpath('users.ks'))
+    assert KS['bob'].attrs == ('a2', 'a3')
+    assert KS['carol'].attrs == ()
+    for (GID, attrs) in users:
+        SK = auth.deserialize__KS(tmp_path.joinpath('users.ks'), GID)
+        assert SK == KS[GID]
+        assert SK.attrs == KS[GID].attrs
+
+def test_key_attributes(auth):
+    SK = auth.SecretKeyGen('alice', ['a2', 'a1'])
+    assert auth.KeyAttributes([], SK) == ['a1', 'a2']
+    assert auth.KeyAttributes(['a2', 'a1'], SK) == ['a1', 'a2']
+    with pytest.raises(ValueError):
+        auth.KeyAttributes(['a1'], SK)
+    with pytest.raises(ValueError):
+        auth.KeyAttributes(['a1', 'a3'], SK)
+
+def test_search(auth):
+    auth.AuthorityPolicy('a1 and (a2 or a3)')
+    CT = auth.EncryptAndIndexGen(MSG, ['k'])
+    SK = auth.SecretKeyGen('alice', ['a3', 'a1'])
+    z = auth.z()
+    Q = auth.PrepareQuery(auth.TrapdoorGen(SK, 'alice', ['k']), auth.TransKeyGen(SK, z, 'alice'), auth.KeyAttributes([], SK))
+    assert auth.SearchPrepared(CT, Q)
+    assert auth.Decrypt(z, auth.TransformPrepared(CT, Q)) == MSG
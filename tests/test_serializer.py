@@ -0,0 +1,99 @@
+# .... SER/DES round trip and framed streams ...
+
+import io
+import random
+
+import pytest
+
+from lsabe_ma.serializer import SER, DES, HEADER, MAGIC, VERSION, is_binary, p_frame, g_frames
+
+def write(binary):
+    b = io.BytesIO()
+    SER(b, None, False, binary = binary).p_size(1234).p_str('policy "a" and b').p_int(-(1 << 70)).p_int(0) \
+        .p_bytes('message').p_b64('AAECAwQ=')
+    return b.getvalue()
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_round_trip(binary):
+    d = write(binary)
+    assert is_binary(d) == binary
+    l = DES(d, None, False)
+    assert l.binary == binary
+    assert l.g_size() == 1234
+    assert l.g_str() == 'policy "a" and b'
+    assert (l.g_int(), l.g_int()) == (-(1 << 70), 0)
+    assert l.g_bytes() == 'message'
+    assert l.g_b64() == 'AAECAwQ='
+    assert l.eof()
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_group_round_trip(binary):
+    pytest.importorskip('charm')
+    from charm.toolbox.pairinggroup import PairingGroup, G1, GT, ZR
+    group = PairingGroup('SS512')
+    V = (group.random(G1), group.random(GT), group.random(ZR))
+    b = io.BytesIO()
+    SER(b, group, False, binary = binary).p_tup(V).p_val(V[:1])
+    l = DES(b.getvalue(), group, False)
+    pos = l.tell()
+    l.skip_tup()
+    assert l.g_val(1) == V[:1]
+    assert l.eof()
+    assert l.seek(pos).g_tup() == V
+
+def test_version():
+    d = write(True)
+    assert d[:len(HEADER)] == HEADER
+    with pytest.raises(ValueError):
+        DES(MAGIC + bytes((VERSION + 1, )) + d[len(HEADER):], None, False)
+
+@pytest.mark.parametrize('n', range(len(MAGIC), len(HEADER)))
+def test_truncated_header(n):
+    with pytest.raises(ValueError):
+        DES(HEADER[:n], None, False)
+
+def test_truncated_field():
+    d = write(True)
+    l = DES(d[:-2], None, False)
+    l.g_size(), l.g_str(), l.g_int(), l.g_int(), l.g_bytes()
+    with pytest.raises(ValueError):
+        l.g_b64()
+
+@pytest.mark.parametrize('cut', [1, 2, 3, 4])
+def test_truncated_size(cut):
+    d = write(True)
+    l = DES(d[:len(HEADER) + 4 - cut], None, False)
+    with pytest.raises(ValueError):
+        l.g_size()
+
+def test_truncated_text():
+    l = DES(write(False), None, False)
+    l.g_size(), l.g_str(), l.g_int(), l.g_int(), l.g_bytes(), l.g_b64()
+    with pytest.raises(ValueError):
+        l.g_size()
+
+FRAMES = [(b'C', b'x' * n) for n in (0, 1, 7, 300, 5000)] + [(b'S', b'{"nmsg": 5}')]
+
+@pytest.mark.parametrize('size', [1, 2, 5, 64, 100000])
+def test_frames(size):
+    d = b''.join(p_frame(k, p) for (k, p) in FRAMES)
+    assert list(g_frames(d[i:i + size] for i in range(0, len(d), size))) == FRAMES
+
+def test_frames_random_chunks():
+    d = b''.join(p_frame(k, p) for (k, p) in FRAMES * 20)
+    rnd = random.Random(1)
+    chunks = []
+    i = 0
+    while i < len(d):
+        n = rnd.randrange(1, 700)
+        chunks.append(d[i:i + n])
+        i += n
+    assert list(g_frames(chunks)) == FRAMES * 20
+
+@pytest.mark.parametrize('cut', [1, 4, 5, 10])
+def test_truncated_frame(cut):
+    d = p_frame(b'C', b'payload') + p_frame(b'C', b'payload')
+    frames = g_frames([d[:-cut]])
+    assert next(frames) == (b'C', b'payload')
+    with pytest.raises(ValueError):
+        next(frames)
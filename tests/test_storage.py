@@ -0,0 +1,84 @@
+# .... Storage server: global setup replaces PP, stored messages and search values are rebuilt ...
+
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('charm')
+
+from lsabe_ma.lsabe_ma import LSABE_MA
+from lsabe_ma.lsabe_authority import LSABE_AUTH
+
+import lsabe_ma_srv
+
+def authority(key_path, curve = 'SS512'):
+    LSABE_MA(key_path, 10, curve = curve).GlobalSetup()
+    LSABE_AUTH(key_path, 10, 1).AuthoritySetup(['a1'])
+    a = LSABE_AUTH(key_path, 10, 1)
+    a.AuthorityLoad()
+    return a
+
+def upload(name):
+    return (io.BytesIO(open(name, 'rb').read()), 'file')
+
+def store(c, a, msg, kw):
+    b = io.BytesIO()
+    a.serialize__CT(a.EncryptAndIndexGen(msg, kw), b, False)
+    return c.post('/store', data = {'CT': (io.BytesIO(b.getvalue()), 'CT')}).status_code
+
+def search(c, a, GID, kw):
+    SK = a.SecretKeyGen(GID, ['a1'])
+    z = a.z()
+    (tds, tks) = (io.BytesIO(), io.BytesIO())
+    a.serialize__TD(a.TrapdoorGen(SK, GID, kw), tds, False)
+    a.serialize__TK(a.TransKeyGen(SK, z, GID), tks, False)
+    r = c.get('/search', data = {'TD': (io.BytesIO(tds.getvalue()), 'TD'), 'TK': (io.BytesIO(tks.getvalue()), 'TK')})
+    if r.status_code != 200:
+        return []
+    return sorted(a.DecryptMany(z, r.get_json()['CTout']))
+
+@pytest.mark.parametrize('curve', ['SS512', 'MNT224'])
+def test_global_setup(tmp_path, curve):
+    (K, D, N) = (tmp_path.joinpath('keys'), tmp_path.joinpath('storage'), tmp_path.joinpath('new'))
+    for p in (K, D, N):
+        p.mkdir()
+    a = authority(K)
+    c = lsabe_ma_srv.create_app(K, D).test_client()
+    assert store(c, a, 'old', ['k']) == 200
+    assert c.post('/register-gid', data = {'GID': 'alice'}).status_code == 200
+    assert search(c, a, 'alice', ['k']) == ['old']
+
+    n = authority(N, curve)
+    r = c.post('/global-setup', data = {'MSK': upload(n.msk_fname), 'PP': upload(n.pp_fname)})
+    assert r.status_code == 200, r.data
+    assert open(str(K.joinpath('lsabe-ma.msk')), 'rb').read() == open(n.msk_fname, 'rb').read()
+    assert open(str(K.joinpath('lsabe-ma.pp')), 'rb').read() == open(n.pp_fname, 'rb').read()
+    r = c.post('/authority-setup', data = {'ASK': upload(n.ask_fname), 'APK': upload(n.apk_fname), 'ATT': upload(n.att_fname)})
+    assert r.status_code == 200, r.data
+
+    assert store(c, n, 'new', ['k']) == 200
+    assert 'new' in search(c, n, 'alice', ['k'])
+    assert 'new' in search(c, n, 'bob', ['k'])
+
+# /register-gid reads stored messages while /store adds them
+def test_register_gid_concurrent_store(tmp_path):
+    (K, D) = (tmp_path.joinpath('keys'), tmp_path.joinpath('storage'))
+    for p in (K, D):
+        p.mkdir()
+    a = authority(K)
+    app = lsabe_ma_srv.create_app(K, D)
+    for i in range(5):
+        assert store(app.test_client(), a, 'msg %d' % i, ['k']) == 200
+
+    def stores():
+        c = app.test_client()
+        return [store(c, a, 'late %d' % i, ['k']) for i in range(20)]
+
+    with ThreadPoolExecutor(2) as pool:
+        S = pool.submit(stores)
+        R = [app.test_client().post('/register-gid', data = {'GID': 'user-%d' % i}).status_code for i in range(20)]
+        assert S.result() == [200] * 20
+    assert R == [200] * 20
+    assert len(search(app.test_client(), a, 'user-7', ['k'])) == 25